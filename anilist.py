@@ -1,38 +1,216 @@
 import json
 import logging
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 from pprint import pprint
-from typing import Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import coloredlogs
 import requests
+from requests.adapters import HTTPAdapter
+
+import utils
+from metrics import Metrics
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
 
+# The fields requested for each entry on the users list
+MEDIA_LIST_FIELDS = '''
+                    id
+                    progress
+                    status
+                    updatedAt
+                    media{
+                        id
+                        type
+                        status
+                        season
+                        episodes
+                    title {
+                        romaji
+                        english
+                    }
+                    }'''
+
+# Only look at these lists as there may be many other types of lists
+LIST_STATUSES = ['CURRENT', 'PLANNING', 'COMPLETED', 'DROPPED', 'PAUSED', 'REPEATING']
+
+
+class RateLimiter:
+    """ A token bucket that paces requests to stay within a per minute budget. Tokens refill continuously at the
+    budgeted rate and a request has to take a token before it is sent. The bucket can be adjusted from the rate limit
+    headers returned by the api and paused entirely when the api asks for requests to stop.
+    """
+
+    def __init__(self, requests_per_minute: int, burst: int) -> None:
+        """ Creates a full token bucket.
+
+        :param requests_per_minute: The number of requests allowed each minute.
+        :param burst: The maximum number of requests that can be sent back to back.
+        :return: None
+        """
+        self.rate = requests_per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        """ Adds the tokens that have accumulated since the bucket was last refilled. Must be called with the lock held.
+
+        :return: None
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """ Blocks until a request is allowed to be sent and takes a token for it.
+
+        :return: None
+        """
+        while True:
+            with self.lock:
+                self.refill()
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def update(self, limit: Optional[str], remaining: Optional[str]) -> None:
+        """ Adjusts the bucket to match the rate limit headers returned by the api.
+
+        :param limit: The X-RateLimit-Limit header, the number of requests allowed each minute.
+        :param remaining: The X-RateLimit-Remaining header, the number of requests left in the current minute.
+        :return: None
+        """
+        with self.lock:
+            self.refill()
+            if limit is not None:
+                self.rate = int(limit) / 60
+            # Never hold more tokens than the api says are left
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+
+    def pause(self, seconds: float) -> None:
+        """ Stops any requests being sent for a number of seconds and empties the bucket.
+
+        :param seconds: The number of seconds to pause for.
+        :return: None
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
 
 @dataclass
 class Anilist:
     """ This is an interface for Anilist. All of the requests sent to the Anilist api are send from here and as such it
     obtains data from Anilist such as the username and users list.
 
+    Requests are sent through one pooled session and paced by a token bucket so that large syncs run as fast as the api
+    allows. Rate limited and server error responses are retried with backoff.
+
+    The users list is cached in the data directory of the account. After the first fetch only the entries updated
+    since the newest cached entry are requested, with the whole list fetched again once the cache is older than
+    full_refresh_age to pick up removed entries, or if the token now belongs to a different user. Changes to the cached
+    list are written once by flush at the end of a sync.
+
     access_token: The access token to use for the Anilist api.
+    api_url: The url of the Anilist GraphQl api.
+    requests_per_minute: The number of requests Anilist allows each minute.
+    burst: The maximum number of requests that are sent back to back.
+    max_retries: The number of times a rate limited or failed request is retried.
+    timeout: The number of seconds to wait for a response.
+    user_list_cache_path: The file to store the users list cache in, which has to be different for each account.
+    full_refresh_age: The number of seconds before the whole users list is fetched again.
+    metrics: The metrics to record requests and timings in.
     """
     access_token: str
+    api_url: str = 'https://graphql.anilist.co'
+    requests_per_minute: int = 90
+    burst: int = 10
+    max_retries: int = 5
+    timeout: int = 30
+    user_list_cache_path: str = 'data/anilist_user_list.json'
+    full_refresh_age: int = 604_800
+    metrics: Metrics = field(default_factory = Metrics, repr = False)
+    session: requests.Session = field(init = False, repr = False)
+    rate_limiter: RateLimiter = field(init = False, repr = False)
 
     class InvalidToken(Exception):
         """ A custom error for when the Anilist token is invalid. """
         pass
 
     def __post_init__(self) -> None:
-        """ Creates the username and user_list properties for this class to save from sending requests every time this
-        data is required by the module.
+        """ Creates the session and rate limiter used for all requests to Anilist.
 
         :return: None
         """
-        self.username = self.get_username()
-        self.user_list = self.fetch_user_list()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.burst)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.hooks['response'].append(self.metrics.response_hook('anilist'))
+        self.session.headers.update({
+            'Authorization': 'Bearer ' + self.access_token,
+            'Accept'       : 'application/json',
+            'Content-Type' : 'application/json'
+        })
+        self.rate_limiter = RateLimiter(self.requests_per_minute, self.burst)
+
+    @cached_property
+    def username(self) -> str:
+        """ The username of the token owner. Only requested from Anilist the first time it is used. """
+        return self.get_username()
+
+    @cached_property
+    def user_list_cache(self) -> utils.JsonStore:
+        """ The cached copy of the users list. """
+        return utils.JsonStore(self.user_list_cache_path, flush_every = 0)
+
+    @cached_property
+    def user_list(self) -> dict:
+        """ The users list keyed by anilist id. Only loaded the first time it is used and kept up to date as updates
+        are made. """
+        return self.load_user_list()
+
+    def load_user_list(self) -> dict:
+        """ Loads the users list from the cache, bringing it up to date with the entries that have changed on Anilist
+        since it was cached. The whole list is fetched if there is no cache, the cache is too old or it was made for a
+        different user.
+
+        :return: A dictionary containing all the shows on the users list.
+        """
+        cache = self.user_list_cache
+        with cache.lock, self.metrics.stage('anilist.user_list'):
+            if (not cache.data.get('entries') or cache.data.get('username') != self.username
+                    or time.time() - cache.data.get('fetched_at', 0) >= self.full_refresh_age):
+                self.metrics.count('anilist.user_list_cache.misses')
+                entries = self.fetch_user_list()
+                cache.replace({
+                    'username'  : self.username,
+                    'fetched_at': time.time(),
+                    'updated_at': max([x.get('updatedAt') or 0 for x in entries.values()], default = 0),
+                    'entries'   : entries
+                })
+            else:
+                self.metrics.count('anilist.user_list_cache.hits')
+                changes = self.fetch_user_list_changes(cache.data.get('updated_at', 0))
+                logger.debug(f"Updating {len(changes)} cached entries of the users list")
+                if changes:
+                    cache.data['entries'].update(changes)
+                    cache.data['updated_at'] = max([x.get('updatedAt') or 0 for x in changes.values()])
+                    cache.mark_changed()
+            self.metrics.add_items('anilist.user_list', len(cache.data['entries']))
+
+        return cache.data['entries']
 
     def get_anime(self, anilist_id: str) -> Optional[dict]:
         """ Gets an anime from the users list with a matching anilist id.
@@ -50,17 +228,38 @@ class Anilist:
         :param variables: Variables to be used in the query conforming to GraphQl syntax.
         :return: The response from the Anilist api in a python readable format.
         """
-        url = 'https://graphql.anilist.co'
-
-        headers = {
-            'Authorization': 'Bearer ' + self.access_token,
-            'Accept'       : 'application/json',
-            'Content-Type' : 'application/json'
-        }
-
-        r = requests.post(
-            url, headers = headers, json = {
-                'query': query, 'variables': variables})
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            self.rate_limiter.acquire()
+            self.metrics.count('anilist.rate_limit_wait_seconds', time.perf_counter() - wait_start)
+            if attempt:
+                self.metrics.count('anilist.retries')
+            try:
+                r = self.session.post(self.api_url, json = {'query': query, 'variables': variables},
+                                      timeout = self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Anilist request failed, retrying in {2 ** attempt}s")
+                time.sleep(2 ** attempt)
+                continue
+
+            self.rate_limiter.update(r.headers.get('X-RateLimit-Limit'), r.headers.get('X-RateLimit-Remaining'))
+            if r.status_code != 429 and r.status_code < 500:
+                break
+
+            if attempt == self.max_retries:
+                r.raise_for_status()
+
+            retry_after = r.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after is not None else min(2 ** attempt, 60)
+            logger.warning(f"Anilist responded with {r.status_code}, retrying in {delay}s")
+            if r.status_code == 429:
+                self.metrics.count('anilist.rate_limited')
+                # Stop every request sharing this limiter until Anilist is ready again
+                self.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
 
         content = json.loads(r.content.decode('utf-8'))
 
@@ -79,26 +278,97 @@ class Anilist:
         :param status: The current status be it "completed", "watching" or "plan to watch".
         :return: Whether or not the update was successful.
         """
-        logger.warning(f"Updating {anilist_id} to {status}")
+        return self.update_series_batch([(anilist_id, progress, status)])[0]
 
-        query = '''
-            mutation ($mediaId: Int, $status: MediaListStatus, $progress: Int) {
-                SaveMediaListEntry (mediaId: $mediaId, status: $status, progress: $progress) {
-                    id
-                    status,
-                    progress
-                }
-            }
-            '''
+    def update_series_batch(self, updates: List[Tuple[str, int, str]], chunk_size: int = 20) -> List[bool]:
+        """ Updates many series on Anilist. The updates are sent as aliased mutations so that each request to Anilist
+        contains up to chunk_size updates instead of one.
 
-        variables = {
-            'mediaId' : anilist_id,
-            'status'  : status,
-            'progress': progress
-        }
+        An update is successful when Anilist returns its entry. Errors that can't be matched to an update, such as a
+        validation error for one of the ids which rejects the whole request, cause the updates without an entry to be
+        sent again one at a time so that only the ones that actually fail are reported as failed.
+
+        :param updates: (anilist id, progress, status) tuples for each series that needs to be updated.
+        :param chunk_size: The maximum number of updates to send in a single request.
+        :return: Whether or not each update was successful in the same order as the updates.
+        """
+        results = []
+        for start in range(0, len(updates), chunk_size):
+            chunk = updates[start:start + chunk_size]
+            for anilist_id, progress, status in chunk:
+                logger.warning(f"Updating {anilist_id} to {status}")
+
+            entries, unmatched_errors = self.send_updates(chunk)
+            if unmatched_errors and len(chunk) > 1:
+                logger.warning("Anilist returned an error without a path, sending the failed updates one at a time")
+                entries = [x if x is not None else self.send_updates([update])[0][0]
+                           for x, update in zip(entries, chunk)]
+
+            for entry in entries:
+                results.append(entry is not None)
+                self.metrics.count('anilist.updates.failed' if entry is None else 'anilist.updates.successful')
+                if entry is not None:
+                    self.record_update(entry)
+
+        return results
+
+    def send_updates(self, updates: List[Tuple[str, int, str]]) -> Tuple[List[Optional[dict]], bool]:
+        """ Sends updates to Anilist as aliased mutations in a single request.
+
+        :param updates: (anilist id, progress, status) tuples for each series that needs to be updated.
+        :return: The updated entry for each update in the same order as the updates, None for the ones that failed,
+                 and whether Anilist returned any errors that couldn't be matched to an update.
+        """
+        parameters = []
+        mutations = []
+        variables = {}
+        for i, (anilist_id, progress, status) in enumerate(updates):
+            parameters.append(f'$mediaId{i}: Int, $status{i}: MediaListStatus, $progress{i}: Int')
+            mutations.append(f'''
+            update{i}: SaveMediaListEntry (mediaId: $mediaId{i}, status: $status{i}, progress: $progress{i}) {{
+                {MEDIA_LIST_FIELDS}
+            }}''')
+            variables.update({f'mediaId{i}': anilist_id, f'status{i}': status, f'progress{i}': progress})
+
+        query = f'''
+        mutation ({', '.join(parameters)}) {{{''.join(mutations)}
+        }}
+        '''
+
+        response = self.send_query(query, variables)
+        data = response.get('data') or {}
+        errors = response.get('errors') or []
+
+        # Errors for a single update are reported with the alias as the first part of their path
+        unmatched_errors = any(not x.get('path') for x in errors)
+        return [data.get(f'update{i}') for i in range(len(updates))], unmatched_errors
+
+    def record_update(self, entry: dict) -> None:
+        """ Stores an entry returned by an update in the users list so the list doesn't need to be fetched again. The
+        cache watermark is moved past the update so the next sync doesn't page back through the entries this sync
+        wrote itself. An entry changed elsewhere while the sync was sending its updates is picked up once it changes
+        again or by the next full refresh.
+
+        :param entry: The updated entry on the users list.
+        :return: None
+        """
+        # Nothing to keep up to date if the list hasn't been loaded
+        if 'user_list' not in self.__dict__:
+            return
+
+        cache = self.user_list_cache
+        with cache.lock:
+            self.user_list[str(entry.get('media').get('id'))] = entry
+            cache.data['updated_at'] = max(cache.data.get('updated_at', 0), entry.get('updatedAt') or 0)
+            cache.mark_changed()
 
-        # If there were no errors so the update was successful
-        return self.send_query(query, variables).get('errors') is None
+    def flush(self) -> None:
+        """ Writes any changes to the cached users list that haven't been saved yet.
+
+        :return: None
+        """
+        if 'user_list_cache' in self.__dict__:
+            self.user_list_cache.flush()
 
     def fetch_user_list(self) -> dict:
         """ Gets the users list from Anilist and formats it into a dictionary so that all the shows are accessible by
@@ -110,32 +380,18 @@ class Anilist:
         """
         logger.warning("Fetching users lists from anilist")
 
-        query = '''
-            query ($username: String) {
-            MediaListCollection(userName: $username, type: ANIME) {
-                lists {
+        query = f'''
+            query ($username: String) {{
+            MediaListCollection(userName: $username, type: ANIME) {{
+                lists {{
                 name
                 status
                 isCustomList
-                entries {
-                    id
-                    progress
-                    status
-                    media{
-                        id
-                        type
-                        status
-                        season
-                        episodes
-                    title {
-                        romaji
-                        english
-                    }
-                    }
-                }
-                }
-            }
-            }
+                entries {{{MEDIA_LIST_FIELDS}
+                }}
+                }}
+            }}
+            }}
             '''
 
         variables = {
@@ -146,13 +402,47 @@ class Anilist:
         all_lists = self.send_query(query, variables).get('data').get('MediaListCollection').get('lists')
         for anilist_list in all_lists:
             # Only look at these lists as there may be many other types of lists
-            if anilist_list.get('status') in ['CURRENT', 'PLANNING', 'COMPLETED', 'DROPPED', 'PAUSED', 'REPEATING']:
+            if anilist_list.get('status') in LIST_STATUSES:
                 for anime in anilist_list.get('entries'):
                     anime_list[str(anime.get('media').get('id'))] = anime
 
-        time.sleep(1)
         return anime_list
 
+    def fetch_user_list_changes(self, since: int) -> dict:
+        """ Gets the entries on the users list that have been updated since a point in time. Entries are requested a
+        page at a time from the most recently updated until an entry older than the requested time is reached.
+
+        :param since: The unix time to get the changes since.
+        :return: A dictionary containing the changed shows keyed by their ids.
+        """
+        logger.warning("Fetching users list changes from anilist")
+
+        query = f'''
+            query ($username: String, $page: Int) {{
+            Page(page: $page, perPage: 50) {{
+                pageInfo {{
+                    hasNextPage
+                }}
+                mediaList(userName: $username, type: ANIME, sort: UPDATED_TIME_DESC) {{{MEDIA_LIST_FIELDS}
+                }}
+            }}
+            }}
+            '''
+
+        changes = {}
+        page = 1
+        while True:
+            result = self.send_query(query, {'username': self.username, 'page': page}).get('data').get('Page')
+            for anime in result.get('mediaList'):
+                if (anime.get('updatedAt') or 0) <= since:
+                    return changes
+                if anime.get('status') in LIST_STATUSES:
+                    changes[str(anime.get('media').get('id'))] = anime
+
+            if not result.get('pageInfo').get('hasNextPage'):
+                return changes
+            page += 1
+
     def get_username(self) -> str:
         """ Gets the username of the user that owns the token that is currently associated with this instance of the
         Anilist object.
@@ -1,67 +1,52 @@
 import logging
-from dataclasses import dataclass
 from pprint import pprint
 from typing import Optional
 
 import coloredlogs
 
-from mapping import Mapping
-from anilist import Anilist
-from config import Config
+from syncContext import SyncContext
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
 
 
-@dataclass
 class Anime:
     """ A object representing an anime holding various data values and providing methods for calculating and obtaining
     information about the anime.
-    """
-    # Class variables
-    config = Config()
-    mapping = Mapping()
-    anilist = Anilist(config.anilist_access_token)
-
-    # Instance variables
-    title: str
-    tvdb_id: str
-    season_number: str
-    watched_episodes: int
-
-    def __post_init__(self) -> None:
-        """ Defines other instance variables that require more complex assignments.
 
+    Anime are created for every season in Plex so they only hold their own values in slots. The Anilist id and users
+    list state are looked up through the context which resolves each season once and shares the result.
+    """
+    __slots__ = ('title', 'tvdb_id', 'season_number', 'watched_episodes', 'episodes', 'year', 'context', 'anilist_id',
+                 'total_episodes', 'anilist_progress', 'anilist_status', 'status')
+
+    def __init__(self, title: str, tvdb_id: str, season_number: str, watched_episodes: int, episodes: Optional[int],
+                 year: Optional[int], context: SyncContext) -> None:
+        """ Creates the anime and resolves its Anilist id and current Anilist state.
+
+        :param title: The title of the show in Plex.
+        :param tvdb_id: The tvdb id of the show.
+        :param season_number: The season number in Plex.
+        :param watched_episodes: The number of watched episodes in Plex.
+        :param episodes: The number of episodes of the season in Plex, if known.
+        :param year: The year the show started, if known.
+        :param context: The context of the current sync run.
         :return: None
         """
-        self.anilist_id = self.obtain_anilist_id()
-        self.total_episodes = self.obtain_total_episodes()
-        self.anilist_progress = (Anime.anilist.get_anime(self.anilist_id) or {}).get('progress')
-        self.anilist_status = (Anime.anilist.get_anime(self.anilist_id) or {}).get('status')
-
+        self.title = title
+        self.tvdb_id = tvdb_id
+        self.season_number = season_number
+        self.watched_episodes = watched_episodes
+        self.episodes = episodes
+        self.year = year
+        self.context = context
+
+        self.anilist_id, self.total_episodes, self.anilist_progress, self.anilist_status = context.resolve(self)
         self.status = self.equate_watch_status()
 
-    def obtain_anilist_id(self) -> Optional[str]:
-        """ Obtains the matching Anilist id from the mapping files.
-
-        :return: The Anilist id for the anime or None if there was no id mapped.
-        """
-        anilist_id = Anime.mapping.get_anilist_id(self.tvdb_id, self.title, self.season_number)
-        if anilist_id is None:
-            Anime.mapping.add_to_mapping_errors(self)
-        return anilist_id
-
-    def obtain_total_episodes(self) -> Optional[int]:
-        """ Obtains the total number of episodes from the Anilist data.
-
-        :return: The total number of episodes
-                 or None if the anime isn't already on Anilist or if the total episodes isn't known by Anilist.
-        """
-        if (anime := Anime.anilist.get_anime(self.anilist_id)) is None:
-            return None
-        x = anime.get('media', {}).get('episodes')
-
-        return x
+    def __repr__(self) -> str:
+        return (f"Anime(title={self.title!r}, tvdb_id={self.tvdb_id!r}, season_number={self.season_number!r}, "
+                f"watched_episodes={self.watched_episodes!r}, anilist_id={self.anilist_id!r})")
 
     def equate_watch_status(self) -> str:
         """ Using the data available determine the watch status of the anime. Whether it is completed, planning to be
@@ -96,14 +81,3 @@ class Anime:
         episodes = self.anilist_progress is None or self.watched_episodes > self.anilist_progress
         needs_update = status or episodes
         return needs_update
-
-    def update_on_anilist(self) -> None:
-        """ Update the anime on Anilist. This will update using the information stored in this object.
-
-        :return: None
-        """
-        logger.info(f"Updating {self.title} Season {self.season_number} on Anilist")
-        successful = Anime.anilist.update_series(self.anilist_id, self.watched_episodes, self.status)
-        if not successful:
-            logger.info(f"Update failed. Anilist id for {self.title} Season {self.season_number} invalid")
-            Anime.mapping.add_to_mapping_errors(self)
@@ -0,0 +1,265 @@
+"""
+Benchmarks each stage of the sync against local stand-ins for Plex and Anilist. A synthetic library of the requested
+size is generated along with matching mapping files and an Anilist users list, and the wall time, number of requests,
+bytes received and peak memory of each stage are reported.
+
+Recorded responses can be replayed instead of the generated ones by passing a fixtures directory. Plex responses are
+listed in an index.json that maps request paths, including their query, to the files to serve for them and the users
+list is read from anilist_user_list.json, in the same format as the generated entries.
+
+Usage: python benchmark.py --seasons 100 1000 20000 --scan-mode bulk
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import standins
+
+LIBRARY = 'Anime'
+
+
+@dataclass
+class StageResult:
+    """ The measurements for a single stage of the sync.
+
+    name: The name of the stage.
+    seconds: The wall time of the stage.
+    plex_requests: The number of requests sent to Plex.
+    plex_bytes: The number of bytes received from Plex.
+    anilist_requests: The number of requests sent to Anilist.
+    anilist_bytes: The number of bytes received from Anilist.
+    peak_memory: The peak memory allocated during the stage in bytes, None if memory wasn't traced.
+    items: The number of items the stage produced.
+    """
+    name: str
+    seconds: float
+    plex_requests: int
+    plex_bytes: int
+    anilist_requests: int
+    anilist_bytes: int
+    peak_memory: Optional[int]
+    items: Optional[int]
+
+
+def run_standins(seasons: int, seed: int, fixtures: Optional[str], urls) -> None:
+    """ Runs the Plex, Anilist and mapping file stand-ins until the process is terminated. They run in their own process
+    so that serving requests doesn't count towards the time and memory of the sync.
+
+    :param seasons: The number of seasons in the synthetic library.
+    :param seed: The seed used to generate the library.
+    :param fixtures: A directory of recorded responses to serve instead of the generated ones.
+    :param urls: A queue to put the urls of the running stand-ins on.
+    :return: None
+    """
+    library = standins.SyntheticLibrary(seasons, seed)
+    entries = library.anilist_entries()
+    if fixtures is not None and os.path.exists(os.path.join(fixtures, 'anilist_user_list.json')):
+        with open(os.path.join(fixtures, 'anilist_user_list.json'), encoding = 'utf-8') as f:
+            entries = json.load(f)
+
+    plex_fixtures = fixtures if fixtures is not None and os.path.exists(os.path.join(fixtures, 'index.json')) else None
+    plex = standins.start_plex_standin(library, fixtures_directory = plex_fixtures)
+    # Report a generous rate limit so the benchmark measures the sync rather than the pacing of requests
+    anilist = standins.start_anilist_standin(entries, rate_limit = 60_000)
+    with tempfile.TemporaryDirectory() as directory:
+        library.write_mapping_files(directory)
+        mapping_files = standins.start_mapping_standin(directory)
+    urls.put((standins.url(plex), standins.url(anilist), standins.url(mapping_files)))
+    while True:
+        time.sleep(60)
+
+
+class Benchmark:
+    """ Runs the stages of the sync one after another in a temporary data directory and measures each of them. """
+
+    def __init__(self, seasons: int, seed: int, scan_mode: str, sync_mode: str, trace_memory: bool,
+                 fixtures: Optional[str] = None) -> None:
+        """ Prepares the benchmark.
+
+        :param seasons: The number of seasons in the synthetic library.
+        :param seed: The seed used to generate the library.
+        :param scan_mode: The scan mode to benchmark.
+        :param sync_mode: The sync mode to use for the full sync stages.
+        :param trace_memory: Whether to measure the peak memory of each stage. This slows every stage down.
+        :param fixtures: A directory of recorded responses to serve instead of the generated ones.
+        :return: None
+        """
+        self.seasons = seasons
+        self.seed = seed
+        self.scan_mode = scan_mode
+        self.sync_mode = sync_mode
+        self.trace_memory = trace_memory
+        self.fixtures = fixtures
+        self.results = []
+        self.plex_url = None
+        self.anilist_url = None
+        self.mapping_url = None
+
+    def measure(self, name: str, stage: Callable) -> object:
+        """ Runs a stage and records its wall time, requests and peak memory.
+
+        :param name: The name of the stage.
+        :param stage: The function that runs the stage.
+        :return: The result of the stage.
+        """
+        standins.reset_stats(self.plex_url)
+        standins.reset_stats(self.anilist_url)
+        if self.trace_memory:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        result = stage()
+        seconds = time.perf_counter() - start
+
+        peak_memory = None
+        if self.trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        items = len(result) if hasattr(result, '__len__') else None
+        self.results.append(StageResult(name, seconds, *standins.get_stats(self.plex_url),
+                                        *standins.get_stats(self.anilist_url), peak_memory, items))
+        return result
+
+    def prepare_data(self) -> None:
+        """ Downloads the mapping files for the library from the mapping file stand-in into the data directory. They
+        are marked as just checked by the download so the sync doesn't check them again.
+
+        :return: None
+        """
+        import mapping
+
+        os.makedirs('data', exist_ok = True)
+        mapping.download_mapping_file(mapping.TVDB_ID_TO_ANIDB_ID_PATH, f'{self.mapping_url}/tvdbid_to_anidbid.xml')
+        mapping.download_mapping_file(mapping.ANIME_OFFLINE_DATABASE_PATH,
+                                      f'{self.mapping_url}/anime-offline-database.json')
+
+    def configure(self) -> None:
+        """ Points the configuration of the sync at the stand-ins.
+
+        :return: None
+        """
+        os.environ.update({
+            'libraries'                 : LIBRARY,
+            'server_url'                : self.plex_url,
+            'server_token'              : 'benchmark',
+            'anilist_access_token'      : 'benchmark',
+            'anilist_api_url'           : self.anilist_url,
+            'tvdb_id_to_anidb_id_url'   : f'{self.mapping_url}/tvdbid_to_anidbid.xml',
+            'anime_offline_database_url': f'{self.mapping_url}/anime-offline-database.json',
+            'scan_mode'                 : self.scan_mode,
+            'sync_mode'                 : self.sync_mode
+        })
+
+    def run(self) -> List[StageResult]:
+        """ Runs every stage of the benchmark.
+
+        :return: The measurements for each stage.
+        """
+        urls = multiprocessing.Queue()
+        process = multiprocessing.Process(target = run_standins, args = (self.seasons, self.seed, self.fixtures, urls),
+                                          daemon = True)
+        process.start()
+        working_directory = os.getcwd()
+        try:
+            self.plex_url, self.anilist_url, self.mapping_url = urls.get(timeout = 120)
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                self.prepare_data()
+                self.configure()
+                self.run_stages()
+        finally:
+            os.chdir(working_directory)
+            process.terminate()
+
+        return self.results
+
+    def run_stages(self) -> None:
+        """ Runs each stage of the sync on its own and then the whole sync, first from cold and then again with every
+        cache warm.
+
+        :return: None
+        """
+        # Imported once the configuration is in place as the modules read it when they are used
+        import mapping
+        import syncHandler
+        from anime import Anime
+        from config import Config
+        from syncContext import SyncContext
+
+        config = Config()
+        context = SyncContext(config)
+
+        self.measure('mapping index build', lambda: mapping.load_mapping_index(config.tvdb_id_to_anidb_id_url,
+                                                                              config.anime_offline_database_url))
+        self.measure('mapping index load', lambda: context.mapping.mapping_index)
+        plex_connection = self.measure('plex connect', lambda: syncHandler.connect_to_plex(context))
+        seasons = self.measure('plex scan', lambda: plex_connection.scan_libraries(config.libraries, config.scan_mode,
+                                                                                  full = True))
+        self.measure('anilist user list', lambda: context.anilist.user_list)
+        self.measure('resolve anime', lambda: [Anime(*x, context) for x in seasons])
+        context.mapping.flush()
+
+        # The whole sync starts again from an empty data directory apart from the mapping files
+        for filename in os.listdir('data'):
+            if not filename.startswith(('tvdbid_to_anidbid.xml', 'anime-offline-database.json')):
+                os.remove(f'data/{filename}')
+        self.measure('sync (cold)', lambda: syncHandler.start_sync().changes)
+        self.measure('sync (warm)', lambda: syncHandler.start_sync().changes)
+
+
+def format_results(seasons: int, results: List[StageResult]) -> str:
+    """ Formats the results of a benchmark as a table.
+
+    :param seasons: The number of seasons in the library.
+    :param results: The measurements for each stage.
+    :return: The results as a table.
+    """
+    lines = [f"{seasons} seasons",
+             f"  {'stage':<20} {'seconds':>9} {'plex req':>9} {'plex KiB':>9} {'ani req':>8} {'ani KiB':>9} "
+             f"{'peak MiB':>9} {'items':>7}"]
+    for x in results:
+        peak = '-' if x.peak_memory is None else f'{x.peak_memory / 1_048_576:.1f}'
+        items = '-' if x.items is None else x.items
+        lines.append(f"  {x.name:<20} {x.seconds:>9.3f} {x.plex_requests:>9} {x.plex_bytes / 1024:>9.0f} "
+                     f"{x.anilist_requests:>8} {x.anilist_bytes / 1024:>9.0f} {peak:>9} {items:>7}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmark the sync against local Plex and Anilist stand-ins.")
+    parser.add_argument('--seasons', type = int, nargs = '+', default = [100, 1000],
+                        help = "The sizes of the synthetic libraries to benchmark.")
+    parser.add_argument('--seed', type = int, default = 0, help = "The seed used to generate the libraries.")
+    parser.add_argument('--scan-mode', default = 'bulk', choices = ['bulk', 'stream', 'serial', 'parallel'],
+                        help = "The Plex scan mode to benchmark.")
+    parser.add_argument('--sync-mode', default = 'batch', choices = ['batch', 'pipeline'],
+                        help = "The sync mode to use for the full sync stages.")
+    parser.add_argument('--fixtures', help = "A directory of recorded Plex and Anilist responses to replay.")
+    parser.add_argument('--no-memory', action = 'store_true',
+                        help = "Don't trace memory, which gives more accurate timings.")
+    parser.add_argument('--json', help = "Also write the results to this json file.")
+    parser.add_argument('--verbose', action = 'store_true', help = "Show the log output of the sync.")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    all_results = {}
+    for size in args.seasons:
+        benchmark_results = Benchmark(size, args.seed, args.scan_mode, args.sync_mode, not args.no_memory,
+                                      args.fixtures).run()
+        all_results[size] = [x.__dict__ for x in benchmark_results]
+        print(format_results(size, benchmark_results), flush = True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_results, f, indent = 2)
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import coloredlogs
+
+import utils
+from plexConnection import PlexSeason
+from syncPlan import PlannedChange, SyncPlan
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+
+@dataclass
+class Checkpoint:
+    """ The progress of a sync run saved to the data directory so that a run that fails partway can be continued
+    instead of started again. It records the seasons found by the Plex scan once the scan has finished and the plan
+    once it has been made. Changes confirmed by Anilist are appended to a separate log as they are sent rather than
+    saving the whole plan again, and are marked on the plan when the checkpoint is loaded. The checkpoint is removed
+    once the run completes.
+
+    filepath: The file to keep the checkpoint in, None to only keep it in memory such as for a dry run.
+    created_at: The unix time the run that created the checkpoint started.
+    seasons: The seasons found by the Plex scan or None if the scan hasn't finished.
+    plan: The plan of changes or None if it hasn't been made.
+    """
+    filepath: Optional[str]
+    created_at: float = field(default_factory = time.time)
+    seasons: Optional[List[PlexSeason]] = None
+    plan: Optional[SyncPlan] = None
+
+    @property
+    def sent_filepath(self) -> Optional[str]:
+        """ The file the changes sent since the checkpoint was last saved are logged to. """
+        return None if self.filepath is None else f'{self.filepath}.sent'
+
+    @property
+    def age(self) -> float:
+        """ The number of seconds since the run that created the checkpoint started. """
+        return time.time() - self.created_at
+
+    @staticmethod
+    def load(filepath: str, max_age: float) -> 'Checkpoint':
+        """ Loads the checkpoint of an unfinished run. A checkpoint older than the maximum age is ignored as the watch
+        state it holds is out of date, so the run starts again from a new checkpoint.
+
+        :param filepath: The file the checkpoint is kept in.
+        :param max_age: The age in seconds after which a checkpoint is ignored.
+        :return: The checkpoint of the unfinished run or a new checkpoint if there isn't one to continue.
+        """
+        if not os.path.exists(filepath):
+            return Checkpoint(filepath)
+
+        data = utils.load_json(filepath)
+        checkpoint = Checkpoint(filepath, data.get('created_at', 0))
+        if checkpoint.age > max_age:
+            logger.info(f"Ignoring the checkpoint of the last sync as it is {checkpoint.age / 60:.0f} minutes old")
+            return Checkpoint(filepath)
+
+        if data.get('seasons') is not None:
+            checkpoint.seasons = [PlexSeason(*x) for x in data.get('seasons')]
+        if data.get('plan') is not None:
+            checkpoint.plan = SyncPlan.from_json(data.get('plan'))
+            checkpoint.load_sent()
+        return checkpoint
+
+    def load_sent(self) -> None:
+        """ Marks the changes logged as sent on the plan. A change is only marked if it still has the values that were
+        sent. A line cut short by the run failing while it was written is ignored.
+
+        :return: None
+        """
+        if not os.path.exists(self.sent_filepath):
+            return
+
+        with open(self.sent_filepath, 'r', encoding = 'utf-8') as f:
+            for line in f:
+                try:
+                    anilist_id, progress, status, successful = json.loads(line)
+                except ValueError:
+                    continue
+                change = self.plan.changes.get(anilist_id)
+                if change is not None and (change.progress, change.status) == (progress, status):
+                    change.successful = successful
+
+    def save(self) -> None:
+        """ Saves the checkpoint. The seasons are left out once the plan has been made as a continued run starts from
+        the plan, so they are only written once.
+
+        :return: None
+        """
+        if self.filepath is None:
+            return
+
+        utils.save_json({'created_at': self.created_at,
+                         'seasons'   : None if self.seasons is None or self.plan is not None else
+                                       [list(x) for x in self.seasons],
+                         'plan'      : None if self.plan is None else self.plan.to_json()}, self.filepath)
+        # The saved plan already holds everything that was logged as sent
+        if os.path.exists(self.sent_filepath):
+            os.remove(self.sent_filepath)
+
+    def record_sent(self, changes: List[PlannedChange]) -> None:
+        """ Appends the changes that have been sent to Anilist to the log of sent changes.
+
+        :param changes: The changes that have been sent.
+        :return: None
+        """
+        if self.filepath is None:
+            return
+
+        lines = [json.dumps([x.anilist_id, x.progress, x.status, x.successful]) + '\n'
+                 for x in changes if x.successful is not None]
+        with open(self.sent_filepath, 'a', encoding = 'utf-8') as f:
+            f.writelines(lines)
+
+    def clear(self) -> None:
+        """ Removes the checkpoint once the run has completed.
+
+        :return: None
+        """
+        for filepath in [self.filepath, self.sent_filepath]:
+            if filepath is not None and os.path.exists(filepath):
+                os.remove(filepath)
@@ -1,4 +1,33 @@
+import json
 import os
+from typing import List, NamedTuple, Optional
+
+from mapping import ANIME_OFFLINE_DATABASE_URL, TVDB_ID_TO_ANIDB_ID_URL
+
+
+class Account(NamedTuple):
+    """ A Plex user and the Anilist account their watch state is synced to. The Plex user can be given as a token or
+    as the name of a user on the server which the server token is used to get a token for. The owner of the server
+    token is used when neither is given. """
+    name: str
+    anilist_access_token: str
+    plex_user: Optional[str] = None
+    plex_token: Optional[str] = None
+
+
+def load_accounts(value: Optional[str]) -> List[Account]:
+    """ Loads the accounts to sync from a json list of objects with the fields of an account. The name is used to
+    keep the files of each account apart and defaults to the Plex user, or 'owner' for the owner of the server token.
+
+    :param value: The json list of accounts.
+    :return: The accounts to sync.
+    """
+    accounts = []
+    for account in json.loads(value or '[]'):
+        name = account.get('name') or account.get('plex_user') or 'owner'
+        accounts.append(Account(name, account['anilist_access_token'], account.get('plex_user'),
+                                account.get('plex_token')))
+    return accounts
 
 
 class Config:
@@ -9,3 +38,35 @@ class Config:
         self.server_token = os.environ.get('server_token')
         self.server_url = os.environ.get('server_url')
         self.anilist_access_token = os.environ.get('anilist_access_token')
+        # Several Plex users to sync to their own Anilist accounts from one process, replaces the Anilist token above
+        self.accounts = load_accounts(os.environ.get('accounts'))
+        # The Anilist GraphQl api to sync with, only changed to point the sync at a local stand-in
+        self.anilist_api_url = os.environ.get('anilist_api_url') or 'https://graphql.anilist.co'
+        # Where the mapping files are downloaded from, only changed to point the sync at a local stand-in or a mirror
+        self.tvdb_id_to_anidb_id_url = os.environ.get('tvdb_id_to_anidb_id_url') or TVDB_ID_TO_ANIDB_ID_URL
+        self.anime_offline_database_url = os.environ.get('anime_offline_database_url') or ANIME_OFFLINE_DATABASE_URL
+
+        # Either 'batch' to scan everything before updating Anilist or 'pipeline' to overlap scanning and updating
+        self.sync_mode = os.environ.get('sync_mode') or 'batch'
+        # How the Plex library is scanned, either 'bulk', 'stream', 'serial' or 'parallel'
+        self.scan_mode = os.environ.get('scan_mode') or 'bulk'
+        # The number of shows fetched at the same time by the parallel scan
+        self.scan_workers = int(os.environ.get('scan_workers') or 8)
+        # The port to listen for Plex webhooks on to sync shows as soon as they are watched, unset to only sync daily
+        self.webhook_port = int(os.environ['webhook_port']) if os.environ.get('webhook_port') else None
+        # Whether episodes are also marked watched in Plex for seasons that are further along on Anilist
+        self.reverse_sync = (os.environ.get('reverse_sync') or 'false').lower() == 'true'
+        # Whether the reverse sync also updates seasons that were mapped to Anilist by title rather than by id
+        self.reverse_sync_title_matches = (os.environ.get('reverse_sync_title_matches') or 'false').lower() == 'true'
+        # How many minutes the progress of a failed sync is kept to be continued by the next attempt, after which Plex
+        # is scanned again
+        self.checkpoint_max_age = int(os.environ.get('checkpoint_max_age') or 360) * 60
+        # Whether seasons without an id mapping are matched to Anilist by the title of their show
+        self.title_matching = (os.environ.get('title_matching') or 'true').lower() == 'true'
+        # How many days a season that couldn't be mapped is remembered before it is checked again, it is also checked
+        # again whenever the mapping files are updated
+        self.unmapped_max_age = int(os.environ.get('unmapped_max_age') or 30) * 86_400
+
+        # Optional files to write the timings and counts of each sync to, as json or as a Prometheus textfile
+        self.metrics_json_path = os.environ.get('metrics_json_path')
+        self.metrics_prometheus_path = os.environ.get('metrics_prometheus_path')
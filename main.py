@@ -1,3 +1,4 @@
+import argparse
 import logging
 import os
 import sys
@@ -7,20 +8,28 @@ import coloredlogs
 import schedule
 from anilist import Anilist
 from plexConnection import PlexConnection
+from config import Config
+from syncHandler import apply_saved_plan, start_account_syncs, start_sync, sync_lock, sync_shows
+from webhook import WebhookListener
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
 
 
-def do_sync(retry: bool = True) -> None:
+def do_sync(retry: bool = True, full: bool = False, dry_run: bool = False) -> None:
     """ Handles the execution of the main syncing function.
 
     :param retry: Whether or not to retry the sync if it fails.
+    :param full: Whether or not to rescan every show in Plex instead of only the ones that have changed.
+    :param dry_run: Whether or not to only print the planned changes instead of sending them to Anilist.
     :return: None
     """
     try:
-        from syncHandler import start_sync
-        start_sync()
+        with sync_lock:
+            if Config().accounts:
+                start_account_syncs(full, dry_run)
+            else:
+                start_sync(full, dry_run)
 
     # These errors can be fixed without restarting the docker container
     except PlexConnection.PlexServerUnreachable as e:
@@ -35,16 +44,38 @@ def do_sync(retry: bool = True) -> None:
     except Exception as e:
         logger.error(f"An error occurred: {e}")
         if retry:
+            # The retry continues from the checkpoint of the failed sync
             logger.info("Retrying now")
-            do_sync(retry = False)
+            do_sync(retry = False, full = full, dry_run = dry_run)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Sync the watch state of Plex libraries to Anilist.")
+    parser.add_argument('--full', action = 'store_true', help = "Rescan every show in Plex on the first sync.")
+    parser.add_argument('--dry-run', action = 'store_true',
+                        help = "Print and save the planned changes without sending them to Anilist, then exit.")
+    parser.add_argument('--apply-plan', action = 'store_true',
+                        help = "Send the changes in the last saved plan to Anilist, then exit.")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        do_sync(retry = False, full = args.full, dry_run = True)
+        sys.exit()
+
+    if args.apply_plan:
+        apply_saved_plan()
+        sys.exit()
+
     # Schedule the sync to run at the specified time
     sync_time = os.environ.get('sync_time')
     schedule.every().day.at(sync_time).do(lambda: do_sync())
     # Run the sync initially when the program starts
-    do_sync()
+    do_sync(full = args.full)
+
+    # Sync shows as soon as they are watched as well as in the daily sync
+    config = Config()
+    if config.webhook_port is not None:
+        WebhookListener(config.webhook_port, config.libraries, sync_shows).start()
 
     # Keep waiting for the time when the sync should occur
     while True:
@@ -1,128 +1,442 @@
 import logging
 import os
 import time
-import urllib.request
 import xml.etree.ElementTree as et
-from typing import Optional
+from functools import cached_property
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import coloredlogs
+import requests
 
 import utils
+from mappingIndex import MappingIndex
+from metrics import Metrics
+from titleMatcher import TitleMatcher, normalise_title, split_season
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
 
 
-def load_tvdb_id_to_anidb_id_xml() -> et.Element:
-    """ Get an up to date version of the mapping from tvdb to anidb.
+TVDB_ID_TO_ANIDB_ID_URL = 'https://raw.githubusercontent.com/ScudLee/anime-lists/master/anime-list-full.xml'
+TVDB_ID_TO_ANIDB_ID_PATH = 'data/tvdbid_to_anidbid.xml'
+ANIME_OFFLINE_DATABASE_URL = 'https://raw.githubusercontent.com/manami-project/anime-offline-database/master/anime-offline-database.json'
+ANIME_OFFLINE_DATABASE_PATH = 'data/anime-offline-database.json'
+MAPPING_INDEX_PATH = 'data/mapping_index.db'
 
-    :return: The up to date tvdb to anidb mapping file.
+
+def iter_anidb_ids(filepath: str) -> Iterator[Tuple[str, str, str]]:
+    """ Streams the tvdb id, tvdb season and anidb id of every entry in the ScudLee mapping xml. Each entry is cleared
+    from the tree once it has been read so the whole document is never held in memory.
+
+    :param filepath: The file path to the tvdb to anidb mapping file.
+    :return: (tvdb id, season, anidb id) tuples in file order.
+    """
+    root = None
+    for event, element in et.iterparse(filepath, events = ('start', 'end')):
+        if root is None:
+            root = element
+        elif event == 'end' and element.tag == 'anime':
+            yield element.get('tvdbid'), element.get('defaulttvdbseason'), element.get('anidbid')
+            root.clear()
+
+
+def iter_anilist_ids(filepath: str) -> Iterator[Tuple[str, str]]:
+    """ Streams the anidb id and anilist id pairs from the sources listed in the anime offline database. Entries are
+    read one at a time and everything other than the sources is discarded.
+
+    :param filepath: The file path to the anime offline database.
+    :return: (anidb id, anilist id) tuples in file order.
+    """
+    for anime in utils.iter_json_array(filepath, 'data'):
+        anidb_ids = []
+        anilist_id = None
+        for source in anime.get('sources'):
+            if source.startswith('https://anidb.net/anime/'):
+                anidb_ids.append(source.rsplit('/')[-1])
+            elif anilist_id is None and source.startswith('https://anilist.co/anime/'):
+                anilist_id = source.rsplit('/')[-1]
+
+        if anilist_id is not None:
+            for anidb_id in anidb_ids:
+                yield anidb_id, anilist_id
+
+
+def iter_anime_titles(filepath: str) -> Iterator[Tuple[str, str, int, Optional[int], Optional[int]]]:
+    """ Streams the normalised title and every synonym of each anime in the anime offline database that has an anilist
+    id, split from the season in the title, along with its episode count and year.
+
+    :param filepath: The file path to the anime offline database.
+    :return: (anilist id, normalised title, season, episodes, year) tuples in file order.
+    """
+    for anime in utils.iter_json_array(filepath, 'data'):
+        anilist_id = next((x.rsplit('/')[-1] for x in anime.get('sources')
+                           if x.startswith('https://anilist.co/anime/')), None)
+        if anilist_id is None:
+            continue
+
+        year = (anime.get('animeSeason') or {}).get('year')
+        titles = {normalise_title(x) for x in [anime.get('title')] + (anime.get('synonyms') or []) if x}
+        for title in titles:
+            if title:
+                yield (anilist_id, *split_season(title), anime.get('episodes') or None, year)
+
+
+def load_mapping_index(tvdb_id_to_anidb_id_url: str = TVDB_ID_TO_ANIDB_ID_URL,
+                       anime_offline_database_url: str = ANIME_OFFLINE_DATABASE_URL) -> MappingIndex:
+    """ Get an up to date compiled index of the mapping files. The index is only rebuilt when one of the mapping files
+    has been downloaded again since it was last built.
+
+    :param tvdb_id_to_anidb_id_url: The download url for the tvdb to anidb mapping file.
+    :param anime_offline_database_url: The download url for the anime offline database.
+    :return: The mapping index.
     """
-    download_url = 'https://raw.githubusercontent.com/ScudLee/anime-lists/master/anime-list-full.xml'
-    filepath = 'data/tvdbid_to_anidbid.xml'
-    # self.update_mapping_xml()
-    update_mapping_file(filepath, download_url)
-    return et.parse(filepath).getroot()
+    updated = update_mapping_files(tvdb_id_to_anidb_id_url, anime_offline_database_url)
+    mapping_index = MappingIndex(MAPPING_INDEX_PATH, [TVDB_ID_TO_ANIDB_ID_PATH, ANIME_OFFLINE_DATABASE_PATH])
+    if updated or not mapping_index.is_current():
+        index_start = time.perf_counter()
+        mapping_index.rebuild(iter_anidb_ids(TVDB_ID_TO_ANIDB_ID_PATH), iter_anilist_ids(ANIME_OFFLINE_DATABASE_PATH),
+                              iter_anime_titles(ANIME_OFFLINE_DATABASE_PATH))
+        logger.debug(f"Built mapping index in {time.perf_counter() - index_start:.2f}s")
 
+    return mapping_index
 
-def load_anime_offline_database() -> dict:
-    """ Get an up to date version of the mapping anime offline database mapping file.
 
-    :return: The up to date anime offline database mapping file.
+def update_mapping_files(tvdb_id_to_anidb_id_url: str = TVDB_ID_TO_ANIDB_ID_URL,
+                         anime_offline_database_url: str = ANIME_OFFLINE_DATABASE_URL) -> bool:
+    """ Re-download any of the mapping files that are in need of being updated.
+
+    :param tvdb_id_to_anidb_id_url: The download url for the tvdb to anidb mapping file.
+    :param anime_offline_database_url: The download url for the anime offline database.
+    :return: Whether or not a new copy of any of the mapping files was downloaded.
     """
-    download_url = 'https://raw.githubusercontent.com/manami-project/anime-offline-database/master/anime-offline-database.json'
-    filepath = 'data/anime-offline-database.json'
-    update_mapping_file(filepath, download_url)
-    # self.update_anime_offline_database()
-    return utils.load_json(filepath).get('data')
+    updated = update_mapping_file(TVDB_ID_TO_ANIDB_ID_PATH, tvdb_id_to_anidb_id_url)
+    return update_mapping_file(ANIME_OFFLINE_DATABASE_PATH, anime_offline_database_url) or updated
 
 
-def update_mapping_file(filepath: str, download_url: str) -> None:
-    """ Re-download a mapping file if it is in need of being updated.
+def get_sources_version(title_matching: bool) -> str:
+    """ Creates a version for the mapping files that changes whenever one of them is downloaded again, which is what
+    a season without a mapping was checked against. Whether title matching was used is part of the version as turning
+    it on can find mappings that the id mappings alone couldn't.
+
+    :param title_matching: Whether seasons are matched by title.
+    :return: The version of the mapping files.
+    """
+    signatures = []
+    for filepath in [TVDB_ID_TO_ANIDB_ID_PATH, ANIME_OFFLINE_DATABASE_PATH]:
+        stat = os.stat(filepath) if os.path.exists(filepath) else None
+        signatures.append('' if stat is None else f'{stat.st_size}:{stat.st_mtime_ns}')
+    return '|'.join(signatures + [f'title_matching={title_matching}'])
+
+
+def update_mapping_file(filepath: str, download_url: str) -> bool:
+    """ Re-download a mapping file if it is in need of being updated. If checking for a new version fails the existing
+    copy of the mapping file is kept.
 
     :param filepath: The file path to the mapping file.
     :param download_url: The download url for the mapping file.
-    :return: None
+    :return: Whether or not a new copy of the mapping file was downloaded.
     """
     logger.info("Updating mapping file")
     if not os.path.exists(filepath):
-        download_mapping_file(filepath, download_url)
+        return download_mapping_file(filepath, download_url)
 
-    file_age = time.time() - os.path.getctime(filepath)
-    # Replace if the old file is 7 days old
-    if file_age >= 603_800:
-        download_mapping_file(filepath, download_url)
+    # Check for a new version if the file was last checked 7 days ago
+    checked_at = load_download_metadata(filepath).get('checked_at') or os.path.getmtime(filepath)
+    if time.time() - checked_at < 603_800:
+        return False
 
+    try:
+        return download_mapping_file(filepath, download_url)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Unable to update mapping file {filepath}, using the existing copy: {e}")
+        return False
 
-def download_mapping_file(filepath: str, download_url: str) -> None:
-    """ Download a mapping file to a specified filepath.
 
-    :param filepath: The file path to save the downloaded mapping file.
-    :param download_url: The download url for the mapping file.
-    :return: None
+def load_download_metadata(filepath: str) -> dict:
+    """ Loads the details stored about the last download of a mapping file.
+
+    :param filepath: The file path to the mapping file.
+    :return: The ETag, Last-Modified and time of the last check for the mapping file.
     """
-    logger.info("Downloading new mapping file")
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    if not os.path.exists(f'{filepath}.meta.json'):
+        return {}
+    return utils.load_json(f'{filepath}.meta.json')
 
-    urllib.request.urlretrieve(download_url, filepath)
 
+def download_mapping_file(filepath: str, download_url: str) -> bool:
+    """ Download a mapping file to a specified filepath if it has changed since it was last downloaded.
 
-def load_tvdb_id_to_anilist_id() -> dict:
+    The request is conditional on the ETag and Last-Modified of the last download so an unchanged file only costs a
+    304 response. The file is streamed to a partial file which is renamed over the old copy once it is complete, so a
+    failed download never removes the existing file and can be resumed on the next attempt.
+
+    :param filepath: The file path to save the downloaded mapping file.
+    :param download_url: The download url for the mapping file.
+    :return: Whether or not a new copy of the mapping file was downloaded.
+    """
+    metadata = load_download_metadata(filepath)
+    partial_filepath = f'{filepath}.part'
+    headers = {'Accept-Encoding': 'gzip'}
+
+    if os.path.exists(filepath):
+        if metadata.get('etag') is not None:
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified') is not None:
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    # Resume a previous download as long as the file hasn't changed since it started
+    if os.path.exists(partial_filepath) and metadata.get('partial_etag') is not None:
+        headers['Range'] = f'bytes={os.path.getsize(partial_filepath)}-'
+        headers['If-Range'] = metadata['partial_etag']
+        # Byte ranges are only meaningful for the unencoded file
+        headers['Accept-Encoding'] = 'identity'
+
+    with requests.get(download_url, headers = headers, stream = True, timeout = 60) as r:
+        if r.status_code == 304:
+            logger.info("Mapping file is already up to date")
+            utils.save_json({**metadata, 'checked_at': time.time()}, f'{filepath}.meta.json')
+            return False
+
+        if r.status_code == 416:
+            # The partial file can't be resumed so start again
+            os.remove(partial_filepath)
+            utils.save_json({**metadata, 'partial_etag': None}, f'{filepath}.meta.json')
+            return download_mapping_file(filepath, download_url)
+
+        r.raise_for_status()
+        logger.info("Downloading new mapping file")
+        utils.save_json({**metadata, 'partial_etag': r.headers.get('ETag')}, f'{filepath}.meta.json')
+        with open(partial_filepath, 'ab' if r.status_code == 206 else 'wb') as f:
+            for chunk in r.iter_content(chunk_size = 65_536):
+                f.write(chunk)
+
+    os.replace(partial_filepath, filepath)
+    utils.save_json({
+        'etag'         : r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'checked_at'   : time.time()
+    }, f'{filepath}.meta.json')
+    return True
+
+
+def load_tvdb_id_to_anilist_id() -> utils.JsonStore:
     """ Get the tvdb to anilist mapping file.
 
     :return: The tvdb to anilist mapping file
     """
     logger.debug("Loading tvdb_id to anilist_id")
-    return utils.load_json('data/tvdbid_to_anilistid.json')
+    return utils.JsonStore('data/tvdbid_to_anilistid.json')
+
+
+def load_unmapped_seasons() -> utils.JsonStore:
+    """ Get the file of seasons that couldn't be mapped to an anilist id.
+
+    :return: The unmapped seasons file
+    """
+    return utils.JsonStore('data/unmapped_seasons.json')
+
+
+def load_title_matched_seasons() -> utils.JsonStore:
+    """ Get the file of seasons that were mapped to an anilist id by matching their title rather than by id.
+
+    :return: The title matched seasons file
+    """
+    return utils.JsonStore('data/title_matched_seasons.json')
 
 
 class Mapping:
     """ A class that handles mapping show ids from different sources so that we can convert between the two. """
 
-    # Load the mapping files for use.s
-    xml_tvdb_id_to_anidb_id = load_tvdb_id_to_anidb_id_xml()
-    tvdb_id_to_anilist_id = load_tvdb_id_to_anilist_id()
-    anime_offline_database = load_anime_offline_database()
+    def __init__(self, metrics: Optional[Metrics] = None, title_matching: bool = True,
+                 unmapped_max_age: float = 2_592_000, tvdb_id_to_anidb_id_url: str = TVDB_ID_TO_ANIDB_ID_URL,
+                 anime_offline_database_url: str = ANIME_OFFLINE_DATABASE_URL) -> None:
+        """ Loads the existing tvdb to anilist mappings, unmapped seasons and mapping errors. The mapping index is only
+        loaded when a new mapping needs to be created.
+
+        Seasons that couldn't be mapped are remembered along with when and against which version of the mapping files
+        they were checked, so they aren't checked again on every run. They are checked again together by
+        refresh_unmapped_seasons once the mapping files change or the entry is too old.
+
+        The seasons that were mapped by title rather than through the mapping files are recorded separately along with
+        the id they were matched to, so a mapping that has since been corrected by hand is no longer treated as a title
+        match.
+
+        Changes to the mappings and mapping errors are kept in memory and only written when enough have built up or
+        when flush is called.
+
+        :param metrics: The metrics to record lookups and timings in.
+        :param title_matching: Whether to match seasons without an id mapping to Anilist by the title of their show.
+        :param unmapped_max_age: The number of seconds after which an unmapped season is checked again even if the
+                                 mapping files haven't changed.
+        :param tvdb_id_to_anidb_id_url: The download url for the tvdb to anidb mapping file.
+        :param anime_offline_database_url: The download url for the anime offline database.
+        :return: None
+        """
+        self.metrics = Metrics() if metrics is None else metrics
+        self.tvdb_id_to_anidb_id_url = tvdb_id_to_anidb_id_url
+        self.anime_offline_database_url = anime_offline_database_url
+        self.title_matching = title_matching
+        self.unmapped_max_age = unmapped_max_age
+        self.tvdb_id_to_anilist_id_store = load_tvdb_id_to_anilist_id()
+        self.tvdb_id_to_anilist_id = self.tvdb_id_to_anilist_id_store.data
+        self.unmapped_seasons_store = load_unmapped_seasons()
+        self.unmapped_seasons = self.unmapped_seasons_store.data
+        self.title_matched_seasons_store = load_title_matched_seasons()
+        self.title_matched_seasons = self.title_matched_seasons_store.data
+        self.mapping_errors = utils.JsonStore('data/mapping_errors.json')
+
+    @cached_property
+    def sources_version(self) -> str:
+        """ The version of the mapping files that new unmapped seasons are recorded against. """
+        return get_sources_version(self.title_matching)
+
+    @cached_property
+    def mapping_index(self) -> MappingIndex:
+        """ The compiled mapping index, downloading and rebuilding it on first use if required. """
+        with self.metrics.stage('mapping.index_load'):
+            return load_mapping_index(self.tvdb_id_to_anidb_id_url, self.anime_offline_database_url)
+
+    @cached_property
+    def title_matcher(self) -> TitleMatcher:
+        """ The matcher used to find Anilist ids by title when there is no id mapping. """
+        return TitleMatcher(self.mapping_index)
 
     def save_tvdb_id_to_anilist_id(self):
         """ Save the tvdbid to anilist mapping file. """
-        utils.save_json(self.tvdb_id_to_anilist_id, 'data/tvdbid_to_anilistid.json')
+        self.tvdb_id_to_anilist_id_store.flush()
+
+    def flush(self) -> None:
+        """ Writes any changes to the mappings and mapping errors that haven't been saved yet.
 
-    def get_anilist_id(self, tvdb_id: str, title: str, season: str) -> Optional[str]:
+        :return: None
+        """
+        self.save_tvdb_id_to_anilist_id()
+        self.unmapped_seasons_store.flush()
+        self.title_matched_seasons_store.flush()
+        self.mapping_errors.flush()
+
+    def get_anilist_id(self, tvdb_id: str, title: str, season: str, year: Optional[int] = None,
+                       episodes: Optional[int] = None) -> Optional[str]:
         """ Get the anilist id from a provided tvdb id, title and season number.
 
         :param tvdb_id: The tvdb id of the show you want to target.
         :param title: The title of the show you want to target.
         :param season: The season number of the show you want to target.
+        :param year: The year the show started, if known. Only used when matching by title.
+        :param episodes: The number of episodes in the season, if known. Only used when matching by title.
         :return: The anilist id of the show or None if a corresponding id wasn't found.
         """
         # Check if mapping already exists
         anilist_id = self.tvdb_id_to_anilist_id.get(tvdb_id, {}).get(season)
         if anilist_id is not None:
+            self.metrics.count('mapping.cache.hits')
             return anilist_id
 
+        # Seasons that couldn't be mapped are only checked again if what they were matched with has changed
+        unmapped = self.unmapped_seasons.get(tvdb_id, {}).get(season)
+        if unmapped is not None:
+            if [unmapped.get(x) for x in ['title', 'year', 'episodes']] == [title, year, episodes]:
+                self.metrics.count('mapping.cache.hits')
+                self.metrics.count('mapping.unmapped_cache.hits')
+                return None
+            self.metrics.count('mapping.unmapped_cache.misses')
+
         # Create a new mapping
-        return self.create_tvdb_id_to_anilist_id_mapping(tvdb_id, title, season)
+        self.metrics.count('mapping.cache.misses')
+        return self.create_tvdb_id_to_anilist_id_mapping(tvdb_id, title, season, year, episodes)
 
-    def create_tvdb_id_to_anilist_id_mapping(self, tvdb_id: str, title: str, season: str) -> Optional[str]:
-        """ Creates abd saves a tvdb to anilist mapping using the current mapping files.
+    def create_tvdb_id_to_anilist_id_mapping(self, tvdb_id: str, title: str, season: str, year: Optional[int] = None,
+                                             episodes: Optional[int] = None) -> Optional[str]:
+        """ Creates abd saves a tvdb to anilist mapping using the current mapping files. If the mapping files don't
+        have an entry for the season the title of the show is matched against the anime offline database instead.
 
         :param tvdb_id: The tvdb id of the show you want to create the mapping for.
         :param title: The title for the show you want to create the mapping for.
         :param season: The season number for the show you want to create the mapping for.
+        :param year: The year the show started, if known.
+        :param episodes: The number of episodes in the season, if known.
         :return: The anilist id that has been mapped or None if it was unable to be mapped.
         """
         logger.warning(f"Creating new anime mapping for {title} Season {season}")
         anilist_id = None
-        if (anidb_id := self.get_anidb_id_from_tvdb_id(tvdb_id, season)) is not None:
-            anilist_id = self.get_anilist_id_from_aod(anidb_id)
-
-        self.tvdb_id_to_anilist_id[tvdb_id] = {**self.tvdb_id_to_anilist_id.get(tvdb_id, {}), **{season: anilist_id}}
-        self.save_tvdb_id_to_anilist_id()
+        title_matched = False
+        with self.metrics.stage('mapping.create'):
+            if (anidb_id := self.get_anidb_id_from_tvdb_id(tvdb_id, season)) is not None:
+                anilist_id = self.get_anilist_id_from_aod(anidb_id)
+
+        if anilist_id is None and self.title_matching:
+            with self.metrics.stage('mapping.title_match'):
+                anilist_id = self.title_matcher.match(title, season, year, episodes)
+            title_matched = anilist_id is not None
+            self.metrics.count('mapping.title_match.misses' if anilist_id is None else 'mapping.title_match.hits')
+
+        if anilist_id is None:
+            self.metrics.count('mapping.unmapped')
+            with self.unmapped_seasons_store.lock:
+                self.unmapped_seasons.setdefault(tvdb_id, {})[season] = {'title'     : title,
+                                                                          'year'      : year,
+                                                                          'episodes'  : episodes,
+                                                                          'sources'   : self.sources_version,
+                                                                          'checked_at': time.time()}
+                self.unmapped_seasons_store.mark_changed()
+
+        with self.tvdb_id_to_anilist_id_store.lock:
+            seasons = self.tvdb_id_to_anilist_id.setdefault(tvdb_id, {})
+            if anilist_id is not None:
+                seasons[season] = anilist_id
+            else:
+                # Older versions stored seasons that couldn't be mapped here as None
+                seasons.pop(season, None)
+            if not seasons:
+                del self.tvdb_id_to_anilist_id[tvdb_id]
+            self.tvdb_id_to_anilist_id_store.mark_changed()
+
+        if title_matched or season in self.title_matched_seasons.get(tvdb_id, {}):
+            with self.title_matched_seasons_store.lock:
+                matched = self.title_matched_seasons.setdefault(tvdb_id, {})
+                if title_matched:
+                    matched[season] = anilist_id
+                else:
+                    matched.pop(season, None)
+                if not matched:
+                    del self.title_matched_seasons[tvdb_id]
+                self.title_matched_seasons_store.mark_changed()
+
+        if anilist_id is not None and season in self.unmapped_seasons.get(tvdb_id, {}):
+            with self.unmapped_seasons_store.lock:
+                del self.unmapped_seasons[tvdb_id][season]
+                if not self.unmapped_seasons[tvdb_id]:
+                    del self.unmapped_seasons[tvdb_id]
+                self.unmapped_seasons_store.mark_changed()
 
         return anilist_id
 
+    def refresh_unmapped_seasons(self) -> None:
+        """ Checks the mapping files for a new version and checks the unmapped seasons that were checked against an
+        older version, or that haven't been checked for longer than the maximum age, all in one pass. Nothing else is
+        loaded when every unmapped season is current.
+
+        :return: None
+        """
+        if update_mapping_files(self.tvdb_id_to_anidb_id_url, self.anime_offline_database_url):
+            # The files were replaced so the version has to be worked out again
+            self.__dict__.pop('sources_version', None)
+
+        now = time.time()
+        with self.unmapped_seasons_store.lock:
+            stale = [(tvdb_id, season, x) for tvdb_id, seasons in self.unmapped_seasons.items()
+                     for season, x in seasons.items() if x.get('sources') != self.sources_version
+                     or now - x.get('checked_at', 0) >= self.unmapped_max_age]
+        if not stale:
+            return
+
+        logger.info(f"Checking {len(stale)} unmapped seasons against the latest mapping files")
+        with self.metrics.stage('mapping.refresh'):
+            for tvdb_id, season, unmapped in stale:
+                self.create_tvdb_id_to_anilist_id_mapping(tvdb_id, unmapped.get('title'), season, unmapped.get('year'),
+                                                          unmapped.get('episodes'))
+        self.metrics.add_items('mapping.refresh', len(stale))
+
     def get_anidb_id_from_tvdb_id(self, tvdb_id: str, season: str) -> Optional[str]:
         """ Gets the anidb id from the tvdb id from the current mapping files.
 
@@ -130,10 +444,7 @@ class Mapping:
         :param season: The season number of the show you want to target.
         :return: The anidb id for the targeted show or None if a mapping wasn't found.
         """
-        for anime in list(self.xml_tvdb_id_to_anidb_id):
-            if anime.get('tvdbid') == tvdb_id and anime.get('defaulttvdbseason') == season:
-                return anime.get('anidbid')
-        return None
+        return self.mapping_index.get_anidb_id(tvdb_id, season)
 
     def get_anilist_id_from_aod(self, anidb_id: str) -> Optional[str]:
         """ Finds the anilist id from a given anidb id using the anime offline database.
@@ -141,12 +452,37 @@ class Mapping:
         :param anidb_id: The anidb id of the show you want to target.
         :return: The anilist id for the targeted show or None if a mapping wasn't found.
         """
-        for anime in self.anime_offline_database:
-            if f'https://anidb.net/anime/{anidb_id}' in anime.get('sources'):
-                for source in anime.get('sources'):
-                    if source.startswith('https://anilist.co/anime/'):
-                        return source.rsplit('/')[-1]
-        return None
+        return self.mapping_index.get_anilist_id(anidb_id)
+
+    def get_mapping_source(self, tvdb_id: str, season: str) -> Optional[str]:
+        """ Gets how a season was mapped to its anilist id.
+
+        :param tvdb_id: The tvdb id of the show you want to target.
+        :param season: The season number of the show you want to target.
+        :return: 'title' if the season was matched by the title of its show, 'id' if it was mapped through the mapping
+                 files or by hand, or None if the season isn't mapped.
+        """
+        anilist_id = self.tvdb_id_to_anilist_id.get(tvdb_id, {}).get(season)
+        if anilist_id is None:
+            return None
+        return 'title' if self.title_matched_seasons.get(tvdb_id, {}).get(season) == anilist_id else 'id'
+
+    def get_tvdb_seasons(self, title_matches: bool = True) -> Dict[str, List[Tuple[str, str]]]:
+        """ Reverses the tvdb to anilist mappings to find the seasons that have been mapped to each Anilist id.
+
+        :param title_matches: Whether to include the seasons that were mapped by matching their title.
+        :return: The tvdb id and season number of each mapped season keyed by Anilist id.
+        """
+        tvdb_seasons = {}
+        with self.tvdb_id_to_anilist_id_store.lock:
+            for tvdb_id, seasons in self.tvdb_id_to_anilist_id.items():
+                for season, anilist_id in seasons.items():
+                    if anilist_id is None:
+                        continue
+                    if not title_matches and self.get_mapping_source(tvdb_id, season) == 'title':
+                        continue
+                    tvdb_seasons.setdefault(anilist_id, []).append((tvdb_id, season))
+        return tvdb_seasons
 
     def add_to_mapping_errors(self, anime) -> None:
         """ Adds an anime to the mapping errors file to be manually added later.
@@ -155,15 +491,16 @@ class Mapping:
         :return: None
         """
         logger.debug(f"Adding {anime.title} Season {anime.season_number} to mapping errors")
-        mapping_errors = utils.load_json('data/mapping_errors.json')
-        if anime.tvdb_id not in mapping_errors:
-            mapping_errors[anime.tvdb_id] = {'title'  : anime.title,
-                                             'seasons': []}
+        with self.mapping_errors.lock:
+            mapping_errors = self.mapping_errors.data
+            if anime.tvdb_id not in mapping_errors:
+                mapping_errors[anime.tvdb_id] = {'title'  : anime.title,
+                                                 'seasons': []}
 
-        if anime.season_number not in mapping_errors[anime.tvdb_id]['seasons']:
-            mapping_errors[anime.tvdb_id]['seasons'].append(anime.season_number)
+            if anime.season_number not in mapping_errors[anime.tvdb_id]['seasons']:
+                mapping_errors[anime.tvdb_id]['seasons'].append(anime.season_number)
 
-        self.save_mapping_errors(mapping_errors)
+            self.mapping_errors.mark_changed()
 
     def save_mapping_errors(self, mapping_errors: dict) -> None:
         """ Saves the mapping errors file.
@@ -171,4 +508,4 @@ class Mapping:
         :param mapping_errors: The mapping errors data to be saved.
         :return: None
         """
-        utils.save_json(mapping_errors, 'data/mapping_errors.json')
+        self.mapping_errors.replace(mapping_errors)
@@ -0,0 +1,214 @@
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import coloredlogs
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+# Increased whenever the tables change so that indexes built by older versions are rebuilt
+SCHEMA_VERSION = 2
+
+
+def title_trigrams(title: str) -> set:
+    """ Splits a normalised title into the trigrams it is indexed under. The title is padded so that the start and end
+    of each word make trigrams of their own.
+
+    :param title: The normalised title.
+    :return: The trigrams of the title.
+    """
+    padded = f'  {title} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MappingIndex:
+    """ A compiled on disk index of the id cross references in the mapping files. The index is stored in a SQLite
+    database so lookups are read on demand instead of holding the parsed mapping files in memory.
+
+    The index records the size and modification time of each source file it was built from so that it only needs to
+    be rebuilt when one of the source files has been replaced.
+
+    The titles and synonyms in the anime offline database are stored along with an inverted index from each trigram of
+    a title to the titles that contain it, so that titles similar to a search can be found without scanning them all.
+    """
+
+    def __init__(self, filepath: str, source_filepaths: List[str]) -> None:
+        """ Opens the index database, creating an empty one if it doesn't exist yet.
+
+        :param filepath: The file path to the index database.
+        :param source_filepaths: The file paths of the mapping files the index is built from.
+        :return: None
+        """
+        self.filepath = filepath
+        self.source_filepaths = source_filepaths
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread = False)
+        self.create_tables()
+
+    def create_tables(self) -> None:
+        """ Creates the index tables if they don't already exist. Tables from an older version of the index are dropped
+        first which leaves the index empty until it is rebuilt.
+
+        :return: None
+        """
+        with self.connection:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                for table in ['sources', 'tvdb_to_anidb', 'anidb_to_anilist', 'titles', 'title_trigrams']:
+                    self.connection.execute(f'DROP TABLE IF EXISTS {table}')
+                self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS sources (filepath TEXT PRIMARY KEY, signature TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS tvdb_to_anidb (
+                    tvdb_id TEXT NOT NULL,
+                    season TEXT,
+                    anidb_id TEXT NOT NULL,
+                    PRIMARY KEY (tvdb_id, season)
+                );
+                CREATE TABLE IF NOT EXISTS anidb_to_anilist (anidb_id TEXT PRIMARY KEY, anilist_id TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS titles (
+                    id INTEGER PRIMARY KEY,
+                    anilist_id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    season INTEGER NOT NULL,
+                    episodes INTEGER,
+                    year INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS titles_title ON titles (title);
+                CREATE TABLE IF NOT EXISTS title_trigrams (
+                    trigram TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    title_ids BLOB NOT NULL
+                );
+                ''')
+
+    def source_signature(self, filepath: str) -> str:
+        """ Creates a signature for a source file that changes whenever the file is replaced.
+
+        :param filepath: The file path of the source file.
+        :return: The signature of the source file.
+        """
+        stat = os.stat(filepath)
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def is_current(self) -> bool:
+        """ Check whether the index was built from the current versions of all its source files.
+
+        :return: Whether or not the index is up to date.
+        """
+        with self.lock:
+            stored = dict(self.connection.execute('SELECT filepath, signature FROM sources'))
+
+        for filepath in self.source_filepaths:
+            if not os.path.exists(filepath) or stored.get(filepath) != self.source_signature(filepath):
+                return False
+        return True
+
+    def rebuild(self, anidb_ids: Iterable[Tuple[str, str, str]], anilist_ids: Iterable[Tuple[str, str]],
+                titles: Iterable[Tuple[str, str, int, Optional[int], Optional[int]]] = ()) -> None:
+        """ Replaces the contents of the index and records the current signatures of the source files.
+
+        Rows are inserted in the order given and the first row for a key wins, which matches scanning the mapping
+        files from the top.
+
+        :param anidb_ids: (tvdb id, season, anidb id) rows from the tvdb to anidb mapping file.
+        :param anilist_ids: (anidb id, anilist id) rows from the anime offline database.
+        :param titles: (anilist id, normalised title, season, episodes, year) rows from the anime offline database.
+                       The title is indexed without its season marker which is given as the season instead.
+        :return: None
+        """
+        logger.info("Rebuilding mapping index")
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM tvdb_to_anidb')
+            self.connection.execute('DELETE FROM anidb_to_anilist')
+            self.connection.execute('DELETE FROM titles')
+            self.connection.execute('DELETE FROM title_trigrams')
+            self.connection.execute('DELETE FROM sources')
+            self.connection.executemany('INSERT OR IGNORE INTO tvdb_to_anidb VALUES (?, ?, ?)', anidb_ids)
+            self.connection.executemany('INSERT OR IGNORE INTO anidb_to_anilist VALUES (?, ?)', anilist_ids)
+
+            postings = {}
+            for title_id, (anilist_id, title, season, episodes, year) in enumerate(titles):
+                self.connection.execute('INSERT INTO titles VALUES (?, ?, ?, ?, ?, ?)',
+                                        (title_id, anilist_id, title, season, episodes, year))
+                for trigram in title_trigrams(title):
+                    postings.setdefault(trigram, array('I')).append(title_id)
+            self.connection.executemany('INSERT INTO title_trigrams VALUES (?, ?, ?)',
+                                        [(k, len(v), v.tobytes()) for k, v in postings.items()])
+            self.connection.executemany('INSERT INTO sources VALUES (?, ?)',
+                                        [(x, self.source_signature(x)) for x in self.source_filepaths])
+
+    def get_anidb_id(self, tvdb_id: str, season: str) -> Optional[str]:
+        """ Looks up the anidb id for a tvdb id and season.
+
+        :param tvdb_id: The tvdb id of the show you want to target.
+        :param season: The season number of the show you want to target.
+        :return: The anidb id or None if there is no entry in the index.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT anidb_id FROM tvdb_to_anidb WHERE tvdb_id = ? AND season = ?',
+                                          (tvdb_id, season)).fetchone()
+        return None if row is None else row[0]
+
+    def get_title_trigram_counts(self, trigrams: Iterable[str]) -> Dict[str, int]:
+        """ Looks up how many titles contain each of some trigrams.
+
+        :param trigrams: The trigrams to look up.
+        :return: The number of titles containing each trigram that is in at least one title.
+        """
+        trigrams = list(trigrams)
+        with self.lock:
+            return dict(self.connection.execute(
+                f'SELECT trigram, count FROM title_trigrams WHERE trigram IN ({", ".join("?" * len(trigrams))})',
+                trigrams))
+
+    def get_title_ids(self, trigram: str) -> array:
+        """ Looks up the titles that contain a trigram.
+
+        :param trigram: The trigram to look up.
+        :return: The ids of the titles containing the trigram.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT title_ids FROM title_trigrams WHERE trigram = ?',
+                                          (trigram,)).fetchone()
+
+        title_ids = array('I')
+        if row is not None:
+            title_ids.frombytes(row[0])
+        return title_ids
+
+    def get_titles_by_title(self, title: str) -> List[Tuple[str, str, int, Optional[int], Optional[int]]]:
+        """ Looks up the stored titles that are exactly the same as a title.
+
+        :param title: The normalised title without its season marker.
+        :return: (anilist id, normalised title, season, episodes, year) rows for the titles.
+        """
+        with self.lock:
+            return self.connection.execute('SELECT anilist_id, title, season, episodes, year FROM titles '
+                                           'WHERE title = ?', (title,)).fetchall()
+
+    def get_titles(self, title_ids: Iterable[int]) -> List[Tuple[str, str, int, Optional[int], Optional[int]]]:
+        """ Looks up stored titles by their ids.
+
+        :param title_ids: The ids of the titles.
+        :return: (anilist id, normalised title, season, episodes, year) rows for the titles.
+        """
+        title_ids = list(title_ids)
+        with self.lock:
+            return self.connection.execute(
+                f'SELECT anilist_id, title, season, episodes, year FROM titles '
+                f'WHERE id IN ({", ".join("?" * len(title_ids))})', title_ids).fetchall()
+
+    def get_anilist_id(self, anidb_id: str) -> Optional[str]:
+        """ Looks up the anilist id for an anidb id.
+
+        :param anidb_id: The anidb id of the show you want to target.
+        :return: The anilist id or None if there is no entry in the index.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT anilist_id FROM anidb_to_anilist WHERE anidb_id = ?',
+                                          (anidb_id,)).fetchone()
+        return None if row is None else row[0]
@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+import coloredlogs
+
+import utils
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+# Prefixed to every metric in the Prometheus textfile
+PROMETHEUS_PREFIX = 'plex_ani_sync'
+
+
+class Metrics:
+    """ Collects the timings and counts of a sync run so that slow runs can be traced to the stage that caused them.
+
+    Stages record how long they took, how many times they ran and how many items they handled. Counters record
+    everything else such as requests, bytes received and cache hits. Counters ending in '.hits' and '.misses' are
+    reported together as a hit rate. Everything can be updated from several threads at once.
+    """
+
+    def __init__(self) -> None:
+        """ Creates an empty set of metrics.
+
+        :return: None
+        """
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ Times a stage of the sync. A stage that runs more than once adds up the time of every run.
+
+        :param name: The name of the stage.
+        :return: A context manager that times the code run inside it.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'items': 0})
+                stage['seconds'] += seconds
+                stage['calls'] += 1
+
+    def add_items(self, name: str, items: int) -> None:
+        """ Records the number of items handled by a stage.
+
+        :param name: The name of the stage.
+        :param items: The number of items handled.
+        :return: None
+        """
+        with self.lock:
+            self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'items': 0})['items'] += items
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """ Adds to a counter.
+
+        :param name: The name of the counter.
+        :param amount: The amount to add to the counter.
+        :return: None
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def response_hook(self, prefix: str) -> Callable:
+        """ Creates a requests response hook that counts the requests sent through a session and the bytes received.
+        Streamed responses are counted by their Content-Length so that the hook never reads the body early.
+
+        :param prefix: The prefix of the counters, such as 'plex'.
+        :return: The response hook.
+        """
+        def hook(response, *args, **kwargs):
+            if kwargs.get('stream'):
+                size = int(response.headers.get('Content-Length') or 0)
+            else:
+                size = len(response.content)
+            self.count(f'{prefix}.requests')
+            self.count(f'{prefix}.bytes', size)
+            if response.status_code >= 400:
+                self.count(f'{prefix}.errors')
+
+        return hook
+
+    @property
+    def hit_rates(self) -> Dict[str, float]:
+        """ The hit rate of every cache that has recorded hits or misses. """
+        with self.lock:
+            counters = dict(self.counters)
+
+        names = {x.rsplit('.', 1)[0] for x in counters if x.endswith(('.hits', '.misses'))}
+        hit_rates = {}
+        for name in sorted(names):
+            hits = counters.get(f'{name}.hits', 0)
+            total = hits + counters.get(f'{name}.misses', 0)
+            hit_rates[name] = hits / total if total else 0.0
+        return hit_rates
+
+    def summary(self) -> dict:
+        """ Creates a json serialisable summary of the run.
+
+        :return: The summary of the run.
+        """
+        with self.lock:
+            stages = {k: dict(v) for k, v in self.stages.items()}
+            counters = dict(self.counters)
+
+        return {
+            'started_at' : self.started_at,
+            'finished_at': time.time(),
+            'stages'     : stages,
+            'counters'   : counters,
+            'hit_rates'  : self.hit_rates
+        }
+
+    def describe(self) -> str:
+        """ Describes the run in a readable form for the logs.
+
+        :return: One line for each stage, counter and hit rate.
+        """
+        summary = self.summary()
+        lines = [f"Sync summary, {summary['finished_at'] - summary['started_at']:.1f}s in total"]
+        for name, stage in summary['stages'].items():
+            lines.append(f"  {name:<32} {stage['seconds']:>9.2f}s {stage['calls']:>6} calls {stage['items']:>8} items")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"  {name:<32} {value:>12.3f}" if isinstance(value, float) else f"  {name:<32} {value:>12}")
+        for name, rate in summary['hit_rates'].items():
+            lines.append(f"  {name + ' hit rate':<32} {rate:>12.1%}")
+        return '\n'.join(lines)
+
+    def to_prometheus(self) -> str:
+        """ Formats the summary of the run in the Prometheus text format.
+
+        :return: The metrics in the Prometheus text format.
+        """
+        summary = self.summary()
+        lines = [f'# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge',
+                 f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {summary["finished_at"]:.0f}']
+        for field, kind in [('seconds', 'stage_seconds'), ('calls', 'stage_calls'), ('items', 'stage_items')]:
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{kind} gauge')
+            for name, stage in summary['stages'].items():
+                lines.append(f'{PROMETHEUS_PREFIX}_{kind}{{stage="{name}"}} {stage[field]}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_counter gauge')
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_counter{{name="{name}"}} {value}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_hit_rate gauge')
+        for name, rate in summary['hit_rates'].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_hit_rate{{cache="{name}"}} {rate}')
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, filepath: str) -> None:
+        """ Writes the metrics to a Prometheus textfile. The file is replaced in one step so the textfile collector
+        never reads a partially written file.
+
+        :param filepath: The file path of the textfile.
+        :return: None
+        """
+        with open(f'{filepath}.tmp', 'w', encoding = 'utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(f'{filepath}.tmp', filepath)
+
+    def save_json(self, filepath: str) -> None:
+        """ Writes the summary of the run to a json file.
+
+        :param filepath: The file path of the json file.
+        :return: None
+        """
+        utils.save_json(self.summary(), filepath)
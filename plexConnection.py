@@ -1,11 +1,20 @@
 import logging
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Dict, Iterator, List, NamedTuple, Optional
+from xml.etree import ElementTree
 
 import coloredlogs
+import plexapi
+import requests
+from requests.adapters import HTTPAdapter
+from plexapi.library import LibrarySection
 from plexapi.video import Show as plexapiShow
 from plexapi.server import PlexServer
 
-from anime import Anime
+import utils
+from metrics import Metrics
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
@@ -14,6 +23,126 @@ coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s',
 logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
 
 
+class PlexSeason(NamedTuple):
+    """ The watch state of a single season of a show in a Plex library. The episode count and year are only used to
+    match seasons to Anilist by title and may be missing from older scan caches. """
+    title: str
+    tvdb_id: str
+    season_number: str
+    watched_episodes: int
+    episodes: Optional[int] = None
+    year: Optional[int] = None
+
+
+def get_tvdb_id(guid: str) -> str:
+    """ Extracts the tvdb id from the guid of a Plex show.
+
+    :param guid: The guid of the show.
+    :return: The tvdb id of the show.
+    """
+    return guid.rsplit('/')[-1].split('?')[0]
+
+
+def get_year(show: plexapiShow) -> Optional[int]:
+    """ Gets the year a Plex show started.
+
+    :param show: The show.
+    :return: The year the show started or None if Plex doesn't know it.
+    """
+    # Read the raw attribute as accessing a missing attribute on a plexapi object can trigger a reload request
+    year = show._data.attrib.get('year')
+    return int(year) if year else None
+
+
+class ScanCache:
+    """ Persists the results of the last library scan along with a watermark for each show so that later scans only
+    need to fetch the shows that have changed. A show's watermark is made from its updatedAt and lastViewedAt times and
+    its episode counts, all of which Plex returns when listing the shows in a library.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        """ Loads the scan cache from the file if one exists.
+
+        :param filepath: The file path of the scan cache.
+        :return: None
+        """
+        self.filepath = filepath
+        cache = utils.load_json(filepath)
+        self.last_sync = cache.get('last_sync')
+        self.shows = cache.get('shows', {})
+        self.seen = set()
+        if self.age is not None:
+            logger.debug(f"Using the scan cache of {len(self.shows)} shows from the last sync "
+                         f"{self.age / 60:.0f} minutes ago")
+
+    @property
+    def age(self) -> Optional[float]:
+        """ The number of seconds since the last sync saved the scan cache, None if it has never been saved. """
+        return None if self.last_sync is None else time.time() - self.last_sync
+
+    @staticmethod
+    def watermark(attributes: Dict[str, str]) -> list:
+        """ Creates the watermark for a show which will change whenever the show's watch state changes.
+
+        :param attributes: The attributes Plex returned for the show.
+        :return: The watermark for the show.
+        """
+        return [attributes.get(x) for x in ['updatedAt', 'lastViewedAt', 'viewedLeafCount', 'leafCount']]
+
+    def get_seasons(self, show: plexapiShow) -> Optional[List[PlexSeason]]:
+        """ Gets the cached seasons for a show if the show hasn't changed since it was cached.
+
+        :param show: The show to get the seasons for.
+        :return: The cached seasons of the show or None if the show needs to be scanned.
+        """
+        # Read the raw attributes as accessing a missing attribute on a plexapi object can trigger a reload request
+        return self.get_cached(str(show.ratingKey), show._data.attrib)
+
+    def get_cached(self, rating_key: str, attributes: Dict[str, str]) -> Optional[List[PlexSeason]]:
+        """ Gets the cached seasons for a show from its rating key and attributes.
+
+        :param rating_key: The rating key of the show.
+        :param attributes: The attributes Plex returned for the show.
+        :return: The cached seasons of the show or None if the show needs to be scanned.
+        """
+        entry = self.shows.get(rating_key)
+        if entry is None or entry.get('watermark') != self.watermark(attributes):
+            return None
+
+        self.seen.add(rating_key)
+        return [PlexSeason(*x) for x in entry.get('seasons')]
+
+    def update(self, show: plexapiShow, seasons: List[PlexSeason]) -> None:
+        """ Stores the scanned seasons of a show along with its current watermark.
+
+        :param show: The show that has been scanned.
+        :param seasons: The seasons of the show.
+        :return: None
+        """
+        self.store(str(show.ratingKey), show._data.attrib, seasons)
+
+    def store(self, rating_key: str, attributes: Dict[str, str], seasons: List[PlexSeason]) -> None:
+        """ Stores the scanned seasons of a show from its rating key and attributes.
+
+        :param rating_key: The rating key of the show.
+        :param attributes: The attributes Plex returned for the show.
+        :param seasons: The seasons of the show.
+        :return: None
+        """
+        self.seen.add(rating_key)
+        self.shows[rating_key] = {'watermark': self.watermark(attributes), 'seasons': [list(x) for x in seasons]}
+
+    def save(self) -> None:
+        """ Saves the scan cache recording the current time as the last successful sync. Shows that weren't seen in
+        this sync are dropped.
+
+        :return: None
+        """
+        self.last_sync = int(time.time())
+        self.shows = {k: v for k, v in self.shows.items() if k in self.seen}
+        utils.save_json({'last_sync': self.last_sync, 'shows': self.shows}, self.filepath)
+
+
 class PlexConnection(PlexServer):
     class PlexServerUnreachable(Exception):
         pass
@@ -21,17 +150,46 @@ class PlexConnection(PlexServer):
     class InvalidPlexToken(Exception):
         pass
 
-    def __init__(self, server_url: str, server_token: str) -> None:
-        """ Connects to plex server with the given url and token.
+    def __init__(self, server_url: str, server_token: str, scan_workers: int = 1, library_workers: int = 1,
+                 metrics: Optional[Metrics] = None, scan_cache_path: str = 'data/plex_scan_cache.json') -> None:
+        """ Connects to plex server with the given url and token. All requests to the server share one keep-alive
+        session with enough pooled connections for every scan worker.
 
         :param server_url: The url to the target plex server.
         :param server_token: The token for the target server.
+        :param scan_workers: The number of shows to fetch at the same time when using the parallel scan.
+        :param library_workers: The number of libraries to scan at the same time.
+        :param metrics: The metrics to record requests and timings in.
+        :param scan_cache_path: The file path of the scan cache, which has to be different for each Plex user.
         :return: None
         """
         logger.warning("Connecting to plex server")
-        super().__init__(server_url, server_token)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.scan_workers = max(scan_workers, 1)
+        self.library_workers = max(library_workers, 1)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.scan_workers * self.library_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.hooks['response'].append(self.metrics.response_hook('plex'))
+        super().__init__(server_url, server_token, session = session)
+        self.scan_cache = ScanCache(scan_cache_path)
         logger.debug("Plex connection established")
 
+    @cached_property
+    def sections(self) -> Dict[str, LibrarySection]:
+        """ The library sections on the server keyed by their title. Only requested from Plex once. """
+        return {x.title: x for x in self.library.sections()}
+
+    def get_user_token(self, username: str) -> Optional[str]:
+        """ Gets a token for another user of the server to read their watch state with. Only works when connected
+        with the token of the server owner.
+
+        :param username: The username or email of the user.
+        :return: The token of the user or None if Plex didn't return one.
+        """
+        return self.myPlexAccount().user(username).get_token(self.machineIdentifier)
+
     def get_shows(self, library: str) -> List[plexapiShow]:
         """ Gets all the shows in a given library.
 
@@ -41,22 +199,235 @@ class PlexConnection(PlexServer):
         logger.debug(f"Getting shows for library {library}")
 
         # If the library doesn't exist return empty list
-        if library not in [x.title for x in self.library.sections()]:
+        if library not in self.sections:
             return []
 
-        return self.library.section(library).all()
+        return self.sections[library].all()
+
+    def scan_library(self, library: str, scan_mode: str, full: bool = False) -> List[PlexSeason]:
+        """ Gets the watch state of every season in a library using the requested scan mode. Only shows that have
+        changed since the last scan are fetched unless a full scan is requested, the rest use the cached results.
+
+        :param library: The name of the target library.
+        :param scan_mode: Either 'bulk' to fetch all the seasons in the library at once, 'stream' to do the same
+                          while parsing the responses directly, 'serial' to fetch the seasons and episodes of each show
+                          one at a time or 'parallel' to fetch several shows at once.
+        :param full: Whether to rescan every show instead of only the ones that have changed.
+        :return: A list of the seasons in the library ordered by show.
+        """
+        scanners = {
+            'bulk'    : self.scan_shows_bulk,
+            'serial'  : self.scan_shows_serial,
+            'parallel': self.scan_shows_parallel
+        }
+
+        if scan_mode == 'stream':
+            return self.scan_library_stream(library, full)
+
+        if scan_mode not in scanners:
+            raise ValueError(f"Unknown scan mode {scan_mode}. Expected one of {', '.join(scanners)}, stream")
+
+        shows = self.get_shows(library)
+        changed = shows if full else [x for x in shows if self.scan_cache.get_seasons(x) is None]
+        if not full:
+            self.metrics.count('plex.scan_cache.hits', len(shows) - len(changed))
+            self.metrics.count('plex.scan_cache.misses', len(changed))
+        logger.debug(f"Scanning {len(changed)} of {len(shows)} shows in library {library} using {scan_mode} scan")
+        scanned = dict(zip([x.ratingKey for x in changed], scanners[scan_mode](library, changed))) if changed else {}
+
+        seasons = []
+        for show in shows:
+            if show.ratingKey in scanned:
+                self.scan_cache.update(show, scanned[show.ratingKey])
+                seasons.extend(scanned[show.ratingKey])
+            else:
+                seasons.extend(self.scan_cache.get_seasons(show))
+
+        return seasons
+
+    def stream_items(self, library: str, libtype: int) -> Iterator[Dict[str, str]]:
+        """ Streams the attributes of every item of a type in a library straight from the XML Plex returns. The
+        response is parsed as it arrives and each item is dropped once it has been handled, so no plexapi objects are
+        created and only the item being handled is held in memory.
+
+        :param library: The name of the library.
+        :param libtype: The Plex type number of the items, 2 for shows and 3 for seasons.
+        :return: The attributes of each item in the order Plex returns them.
+        """
+        if library not in self.sections:
+            return
+
+        response = self._session.get(self.url(f'/library/sections/{self.sections[library].key}/all'),
+                                     params = {'type': libtype}, headers = self._headers(), timeout = plexapi.TIMEOUT,
+                                     stream = True)
+        with response:
+            response.raise_for_status()
+            # Let urllib3 undo any compression of the response as it is read
+            response.raw.decode_content = True
+            events = ElementTree.iterparse(response.raw, events = ('start', 'end'))
+            _, container = next(events)
+            for event, element in events:
+                if event == 'end' and element.tag == 'Directory':
+                    yield element.attrib
+                    container.clear()
+
+    def scan_library_stream(self, library: str, full: bool = False) -> List[PlexSeason]:
+        """ Gets the watch state of every season in a library with one streamed request for the shows and, if any
+        have changed, one for the seasons. The watch state is read from the attributes of the XML as it is parsed in
+        the same way as the bulk scan but without creating a plexapi object for every show and season.
+
+        :param library: The name of the target library.
+        :param full: Whether to rescan every show instead of only the ones that have changed.
+        :return: A list of the seasons in the library ordered by show.
+        """
+        shows = {}
+        cached = {}
+        for attributes in self.stream_items(library, 2):
+            rating_key = attributes.get('ratingKey')
+            year = attributes.get('year')
+            shows[rating_key] = (attributes.get('title'), get_tvdb_id(attributes.get('guid') or ''),
+                                 int(year) if year else None, attributes)
+            if not full and (show_seasons := self.scan_cache.get_cached(rating_key, attributes)) is not None:
+                cached[rating_key] = show_seasons
+
+        changed = [x for x in shows if x not in cached]
+        if not full:
+            self.metrics.count('plex.scan_cache.hits', len(cached))
+            self.metrics.count('plex.scan_cache.misses', len(changed))
+        logger.debug(f"Scanning {len(changed)} of {len(shows)} shows in library {library} using stream scan")
+
+        scanned = {x: [] for x in changed}
+        if changed:
+            for attributes in self.stream_items(library, 3):
+                rating_key = attributes.get('parentRatingKey')
+                if rating_key in scanned and (attributes.get('title') or '').lower() != 'specials':
+                    title, tvdb_id, year, _ = shows[rating_key]
+                    scanned[rating_key].append(PlexSeason(title, tvdb_id, attributes.get('index'),
+                                                          int(attributes.get('viewedLeafCount') or 0),
+                                                          int(attributes.get('leafCount') or 0), year))
+
+        seasons = []
+        for rating_key, (_, _, _, attributes) in shows.items():
+            if rating_key in scanned:
+                show_seasons = sorted(scanned[rating_key], key = lambda x: int(x.season_number or 0))
+                self.scan_cache.store(rating_key, attributes, show_seasons)
+                seasons.extend(show_seasons)
+            else:
+                seasons.extend(cached[rating_key])
+
+        return seasons
+
+    def scan_show(self, show: plexapiShow) -> List[PlexSeason]:
+        """ Gets the watch state of every season of a show by requesting its seasons and the episodes of each season.
+
+        :param show: The show to scan.
+        :return: A list of the seasons of the show.
+        """
+        seasons = []
+        tvdb_id = get_tvdb_id(show.guid)
+        year = get_year(show)
+        for season in [x for x in show.seasons() if x.title.lower() != 'specials']:
+            episodes = season.episodes()
+            watched_episodes = len([x for x in episodes if x.isWatched])
+            seasons.append(PlexSeason(show.title, tvdb_id, str(season.seasonNumber), watched_episodes, len(episodes),
+                                      year))
+
+        return seasons
+
+    def scan_shows_serial(self, library: str, shows: List[plexapiShow]) -> List[List[PlexSeason]]:
+        """ Gets the watch state of every season of some shows by scanning each show one after another. This takes one
+        request per show and season.
+
+        :param library: The name of the library the shows are in.
+        :param shows: The shows to scan.
+        :return: The seasons of each show in the same order as the shows.
+        """
+        return [self.scan_show(show) for show in shows]
+
+    def scan_shows_parallel(self, library: str, shows: List[plexapiShow]) -> List[List[PlexSeason]]:
+        """ Gets the watch state of every season of some shows by scanning several shows at the same time. This takes
+        as many requests as the serial scan but spreads them across the scan workers.
+
+        :param library: The name of the library the shows are in.
+        :param shows: The shows to scan.
+        :return: The seasons of each show in the same order as the shows.
+        """
+        with ThreadPoolExecutor(max_workers = self.scan_workers) as executor:
+            # Map returns the results in the order of the shows regardless of which finishes first
+            return list(executor.map(self.scan_show, shows))
+
+    def scan_shows_bulk(self, library: str, shows: List[plexapiShow]) -> List[List[PlexSeason]]:
+        """ Gets the watch state of every season of some shows with one section wide query for the seasons. The
+        watched count is taken from the viewed leaf count Plex returns with each season so the episodes never need to
+        be requested.
+
+        :param library: The name of the library the shows are in.
+        :param shows: The shows to scan.
+        :return: The seasons of each show in the same order as the shows.
+        """
+        # Group the seasons under the show they belong to
+        show_seasons = {str(show.ratingKey): [] for show in shows}
+        for season in self.sections[library].search(libtype = 'season'):
+            if season.title.lower() != 'specials' and str(season.parentRatingKey) in show_seasons:
+                show_seasons[str(season.parentRatingKey)].append(season)
+
+        seasons = []
+        for show in shows:
+            tvdb_id = get_tvdb_id(show.guid)
+            year = get_year(show)
+            seasons.append([PlexSeason(show.title, tvdb_id, str(x.seasonNumber), x.viewedLeafCount, x.leafCount, year)
+                            for x in sorted(show_seasons[str(show.ratingKey)], key = lambda x: x.seasonNumber)])
+
+        return seasons
+
+    def scrobble(self, rating_key: int) -> None:
+        """ Marks a show, season or episode as watched.
+
+        :param rating_key: The rating key of the item.
+        :return: None
+        """
+        self.query(f'/:/scrobble?key={rating_key}&identifier=com.plexapp.plugins.library')
+        self.metrics.count('plex.scrobbles')
+
+    def mark_seasons_watched(self, show_rating_key: str, season_progress: Dict[str, int]) -> None:
+        """ Marks the first episodes of some seasons of a show as watched. The seasons of the show are requested once
+        and a season with every episode to be marked watched is marked with a single request for the whole season.
+        Otherwise the episodes of the season are requested and only the ones that aren't watched are marked.
+
+        :param show_rating_key: The rating key of the show.
+        :param season_progress: The number of episodes to mark watched keyed by season number.
+        :return: None
+        """
+        for season in self.fetchItems(f'/library/metadata/{show_rating_key}/children'):
+            progress = season_progress.get(str(season.index))
+            if progress is None:
+                continue
+
+            logger.info(f"Marking {progress} episodes of {season.parentTitle} Season {season.index} watched in Plex")
+            if progress >= season.leafCount:
+                self.scrobble(season.ratingKey)
+                continue
+
+            episodes = sorted(season.episodes(), key = lambda x: x.index or 0)
+            for episode in [x for x in episodes[:progress] if not x.isWatched]:
+                self.scrobble(episode.ratingKey)
 
-    def get_anime(self, library: str) -> List[Anime]:
-        """ Loads all the shows and seasons in a library into a list of anime objects.
+    def scan_libraries(self, libraries: List[str], scan_mode: str, full: bool = False) -> List[PlexSeason]:
+        """ Scans several libraries at the same time and merges their seasons. A season that appears in more than one
+        library is only kept once using the highest watched count.
 
-        :param library: The Plex library to look through.
-        :return: A list of Anime objects representing the shows in the targeted library.
+        :param libraries: The names of the target libraries.
+        :param scan_mode: The scan mode to use for each library.
+        :param full: Whether to rescan every show instead of only the ones that have changed.
+        :return: A list of the unique seasons across all the libraries.
         """
-        anime = []
-        for show in self.get_shows(library):
-            tvdb_id = show.guid.rsplit('/')[-1].split('?')[0]
-            for season in [x for x in show.seasons() if x.title.lower() != 'specials']:
-                watched_episodes = len([x for x in season.episodes() if x.isWatched])
-                anime.append(Anime(show.title, tvdb_id, str(season.seasonNumber), watched_episodes))
+        merged = {}
+        with self.metrics.stage('plex.scan'), ThreadPoolExecutor(max_workers = self.library_workers) as executor:
+            results = executor.map(lambda x: self.scan_library(x, scan_mode, full), libraries)
+            for season in [x for library_seasons in results for x in library_seasons]:
+                key = (season.tvdb_id, season.season_number)
+                if key not in merged or season.watched_episodes > merged[key].watched_episodes:
+                    merged[key] = season
 
-        return anime
+        self.metrics.add_items('plex.scan', len(merged))
+        return list(merged.values())
@@ -0,0 +1,101 @@
+import logging
+from typing import List, NamedTuple
+
+import coloredlogs
+
+from mapping import Mapping
+from metrics import Metrics
+from plexConnection import PlexConnection, PlexSeason, ScanCache
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+
+class ReverseChange(NamedTuple):
+    """ A season in Plex that is behind the progress on Anilist and the number of its episodes to mark watched. """
+    show_rating_key: str
+    season: PlexSeason
+    anilist_id: str
+    progress: int
+
+
+def get_anilist_progress(entry: dict) -> int:
+    """ Gets the number of watched episodes of an entry on the users list. A completed entry counts every episode as
+    watched even if its progress wasn't updated.
+
+    :param entry: The entry on the users list.
+    :return: The number of watched episodes.
+    """
+    progress = entry.get('progress') or 0
+    episodes = (entry.get('media') or {}).get('episodes')
+    if entry.get('status') == 'COMPLETED' and episodes:
+        return max(progress, episodes)
+    return progress
+
+
+def plan_reverse_sync(scan_cache: ScanCache, user_list: dict, mapping: Mapping,
+                      title_matches: bool = False) -> List[ReverseChange]:
+    """ Works out the seasons in Plex that have fewer watched episodes than their progress on Anilist. The entries on
+    the users list are resolved back to the seasons mapped to them and compared with the watch state from the last
+    scan, so seasons that are already up to date need no requests to Plex.
+
+    Seasons that were mapped by matching their title are skipped unless requested, as a wrong match would mark
+    episodes of an unrelated show watched in Plex.
+
+    :param scan_cache: The scan cache holding the seasons of each show from the last scan.
+    :param user_list: The users list from Anilist.
+    :param mapping: The mapping that converted the seasons into Anilist ids.
+    :param title_matches: Whether to also update the seasons that were mapped by matching their title.
+    :return: The changes needed to bring Plex in line with Anilist.
+    """
+    show_seasons = {}
+    for rating_key, entry in scan_cache.shows.items():
+        for season in [PlexSeason(*x) for x in entry.get('seasons')]:
+            show_seasons.setdefault((season.tvdb_id, season.season_number), []).append((rating_key, season))
+
+    changes = []
+    for anilist_id, tvdb_seasons in mapping.get_tvdb_seasons(title_matches).items():
+        entry = user_list.get(anilist_id)
+        # Progress on Anilist can't be split between several seasons mapped to the same entry
+        if entry is None or len(tvdb_seasons) != 1:
+            continue
+
+        progress = get_anilist_progress(entry)
+        for rating_key, season in show_seasons.get(tvdb_seasons[0], []):
+            target = progress if season.episodes is None else min(progress, season.episodes)
+            if season.watched_episodes < target:
+                changes.append(ReverseChange(rating_key, season, anilist_id, target))
+
+    return changes
+
+
+def describe_reverse_sync(changes: List[ReverseChange]) -> str:
+    """ Describes the changes to Plex in a readable form for a dry run.
+
+    :param changes: The changes to describe.
+    :return: One line for each change.
+    """
+    lines = [f"{len(changes)} seasons to mark watched in Plex"]
+    for change in changes:
+        lines.append(f"  {change.season.title} Season {change.season.season_number} ({change.anilist_id}) -> "
+                     f"{change.progress} watched, {change.season.watched_episodes} watched in Plex")
+    return '\n'.join(lines)
+
+
+def apply_reverse_sync(plex_connection: PlexConnection, changes: List[ReverseChange], metrics: Metrics) -> None:
+    """ Marks episodes watched in Plex to match Anilist. The changes are grouped by show so the seasons of each show
+    are only requested once.
+
+    :param plex_connection: The connection to the Plex server to update.
+    :param changes: The changes to make.
+    :param metrics: The metrics to record the timings in.
+    :return: None
+    """
+    shows = {}
+    for change in changes:
+        shows.setdefault(change.show_rating_key, {})[change.season.season_number] = change.progress
+
+    with metrics.stage('plex.reverse_sync'):
+        for rating_key, season_progress in shows.items():
+            plex_connection.mark_seasons_watched(rating_key, season_progress)
+    metrics.add_items('plex.reverse_sync', len(changes))
@@ -0,0 +1,617 @@
+"""
+Local stand-ins for the Plex server, the Anilist GraphQl api and the mapping file downloads along with a generator for
+synthetic libraries and matching mapping files. These let the sync run end to end without a real Plex server or Anilist
+account, for benchmarking, testing and trying out changes.
+
+Every stand-in counts the requests it receives and the bytes it sends. The counts are served at /_stats and reset by
+sending a POST to /_reset so they can be read when the stand-in runs in another process.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import quoteattr
+
+
+LIST_STATUSES = ['CURRENT', 'PLANNING', 'COMPLETED', 'DROPPED', 'PAUSED']
+SYLLABLES = ['ka', 'ki', 'ku', 'ko', 'sa', 'shi', 'su', 'ta', 'chi', 'tsu', 'na', 'ni', 'no', 'ha', 'hi', 'ma', 'mi',
+             'mo', 'ra', 'ri', 'ro', 'ya', 'yu', 'yo', 'ze', 'ga', 'ryu', 'sei', 'ten', 'kai']
+
+
+@dataclass
+class SyntheticSeason:
+    """ A season of a synthetic show. """
+    rating_key: int
+    index: int
+    episodes: int
+    watched: int
+    anidb_id: Optional[str]
+    anilist_id: Optional[str]
+    in_scudlee: bool
+
+
+@dataclass
+class SyntheticShow:
+    """ A show in a synthetic library. """
+    rating_key: int
+    title: str
+    tvdb_id: str
+    year: int
+    seasons: List[SyntheticSeason] = field(default_factory = list)
+
+
+@dataclass
+class SyntheticLibrary:
+    """ A generated anime library with matching mapping files and Anilist user list. The same seed always generates
+    the same library so separate processes can generate it independently.
+
+    seasons: The number of seasons to generate, excluding specials.
+    seed: The seed for the random generator.
+    unmapped: The fraction of seasons that have no tvdb mapping. Half of them are still in the anime offline database
+              so they can be matched by title.
+    on_list: The fraction of mapped seasons that are already on the users list.
+    """
+    seasons: int
+    seed: int = 0
+    unmapped: float = 0.05
+    on_list: float = 0.6
+    shows: List[SyntheticShow] = field(default_factory = list, init = False)
+
+    def __post_init__(self) -> None:
+        """ Generates the shows and seasons of the library.
+
+        :return: None
+        """
+        generator = random.Random(self.seed)
+        count = 0
+        while count < self.seasons:
+            number = len(self.shows)
+            words = [''.join(generator.choice(SYLLABLES) for _ in range(generator.randint(2, 3))).capitalize()
+                     for _ in range(generator.randint(2, 3))]
+            show = SyntheticShow(100_000 + number, ' '.join(words), str(200_000 + number),
+                                 generator.randint(1990, 2024))
+            for index in range(1, min(generator.randint(1, 4), self.seasons - count) + 1):
+                episodes = generator.choice([12, 13, 24, 25, 50])
+                watched = generator.choice([0, episodes, generator.randint(0, episodes)])
+                in_scudlee = generator.random() >= self.unmapped
+                listed = in_scudlee or generator.random() < 0.5
+                anidb_id = str(300_000 + count) if listed else None
+                anilist_id = str(400_000 + count) if listed else None
+                show.seasons.append(SyntheticSeason(show.rating_key * 100 + index, index, episodes, watched, anidb_id,
+                                                    anilist_id, in_scudlee))
+                count += 1
+            self.shows.append(show)
+
+    def write_mapping_files(self, directory: str) -> None:
+        """ Writes a ScudLee style tvdb to anidb mapping file and an anime offline database that cover the seasons of
+        the library that have ids.
+
+        :param directory: The directory to write the mapping files to.
+        :return: None
+        """
+        with open(os.path.join(directory, 'tvdbid_to_anidbid.xml'), 'w', encoding = 'utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<anime-list>\n')
+            for show, season in self.iter_seasons():
+                if season.in_scudlee:
+                    f.write(f'  <anime anidbid="{season.anidb_id}" tvdbid="{show.tvdb_id}" '
+                            f'defaulttvdbseason="{season.index}">\n    <name>{show.title}</name>\n  </anime>\n')
+            f.write('</anime-list>\n')
+
+        with open(os.path.join(directory, 'anime-offline-database.json'), 'w', encoding = 'utf-8') as f:
+            data = [{'sources'    : [f'https://anidb.net/anime/{season.anidb_id}',
+                                     f'https://anilist.co/anime/{season.anilist_id}'],
+                     'title'      : show.title if season.index == 1 else f'{show.title} Season {season.index}',
+                     'episodes'   : season.episodes,
+                     'animeSeason': {'season': 'SPRING', 'year': show.year + season.index - 1},
+                     'synonyms'   : [f'{show.title} {season.index}']}
+                    for show, season in self.iter_seasons() if season.anidb_id is not None]
+            json.dump({'data': data}, f)
+
+    def iter_seasons(self):
+        """ Iterates over every season in the library along with its show.
+
+        :return: (show, season) tuples.
+        """
+        for show in self.shows:
+            for season in show.seasons:
+                yield show, season
+
+    def anilist_entries(self) -> Dict[str, dict]:
+        """ Generates the users list for the Anilist stand-in. Some of the mapped seasons are on the list with progress
+        that is behind, equal to or ahead of Plex.
+
+        :return: The users list entries keyed by Anilist id.
+        """
+        generator = random.Random(self.seed + 1)
+        entries = {}
+        for show, season in self.iter_seasons():
+            if season.anilist_id is None or generator.random() >= self.on_list:
+                continue
+            entries[season.anilist_id] = {
+                'progress'  : generator.randint(0, season.episodes),
+                'status'    : generator.choice(LIST_STATUSES),
+                'episodes'  : season.episodes,
+                'title'     : f'{show.title} Season {season.index}',
+                'updatedAt' : generator.randint(1, 1_000_000)
+            }
+        return entries
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    """ A request handler that counts requests and bytes sent, and serves the counts at /_stats. """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        """ Keep the stand-ins quiet. """
+        pass
+
+    def send_body(self, body: bytes, status: int = 200, content_type: str = 'application/json',
+                  headers: Optional[Dict[str, str]] = None) -> None:
+        """ Sends a response and records it in the stand-in's stats.
+
+        :param body: The body of the response.
+        :param status: The status code of the response.
+        :param content_type: The content type of the response.
+        :param headers: Any extra headers to send.
+        :return: None
+        """
+        stats = self.server.stats
+        with self.server.stats_lock:
+            stats['requests'] += 1
+            stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_stats(self) -> bool:
+        """ Serves or resets the stats if they were requested.
+
+        :return: Whether the request was for the stats.
+        """
+        if self.path == '/_stats':
+            body = json.dumps(self.server.stats).encode()
+        elif self.path == '/_reset':
+            with self.server.stats_lock:
+                self.server.stats.update({'requests': 0, 'bytes': 0})
+            body = b'{}'
+        else:
+            return False
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def read_body(self) -> bytes:
+        """ Reads the body of the request.
+
+        :return: The body of the request.
+        """
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+
+class PlexHandler(StatsHandler):
+    """ Serves the parts of the Plex api used by the sync for a synthetic library. Responses can be replaced with
+    recorded fixtures which are served for exact path and query matches. """
+
+    def do_GET(self) -> None:
+        if self.handle_stats():
+            return
+
+        plex = self.server.plex
+        if self.path in plex.fixtures:
+            self.send_body(plex.fixtures[self.path], content_type = 'text/xml')
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        items = plex.route(url.path, query)
+        if items is None:
+            self.send_body(b'', 404, 'text/plain')
+            return
+
+        # Page the results the same way Plex does for clients that request a container range
+        start = int(self.headers.get('X-Plex-Container-Start') or query.get('X-Plex-Container-Start', [0])[0])
+        size = self.headers.get('X-Plex-Container-Size') or query.get('X-Plex-Container-Size', [None])[0]
+        page = items[start:] if size is None else items[start:start + int(size)]
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><MediaContainer size="{len(page)}" '
+                f'totalSize="{len(items)}" offset="{start}" librarySectionID="1">{"".join(page)}</MediaContainer>')
+        self.send_body(body.encode(), content_type = 'text/xml')
+
+    def do_PUT(self) -> None:
+        self.do_GET()
+
+    def do_POST(self) -> None:
+        if not self.handle_stats():
+            self.do_GET()
+
+
+class PlexStandin:
+    """ The state behind the Plex stand-in. """
+
+    def __init__(self, library: SyntheticLibrary, fixtures_directory: Optional[str] = None) -> None:
+        """ Prepares the Plex responses for a synthetic library.
+
+        :param library: The library to serve.
+        :param fixtures_directory: A directory of recorded responses with an index.json mapping request paths, including
+                                   their query, to the files to serve for them.
+        :return: None
+        """
+        self.library = library
+        self.fixtures = {}
+        if fixtures_directory is not None:
+            with open(os.path.join(fixtures_directory, 'index.json'), encoding = 'utf-8') as f:
+                for path, filename in json.load(f).items():
+                    with open(os.path.join(fixtures_directory, filename), 'rb') as fixture:
+                        self.fixtures[path] = fixture.read()
+
+        self.items = {}
+        self.children = {}
+        for show in library.shows:
+            self.items[show.rating_key] = (show, None, None)
+            self.children[show.rating_key] = [season.rating_key for season in show.seasons]
+            for season in show.seasons:
+                self.items[season.rating_key] = (show, season, None)
+                episodes = [season.rating_key * 1000 + x for x in range(season.episodes)]
+                self.children[season.rating_key] = episodes
+                for number, episode in enumerate(episodes):
+                    self.items[episode] = (show, season, number)
+
+    @staticmethod
+    def attributes(**values) -> str:
+        """ Formats keyword arguments as xml attributes. """
+        return ' '.join(f'{k}={quoteattr(str(v))}' for k, v in values.items() if v is not None)
+
+    def show_xml(self, show: SyntheticShow) -> str:
+        """ Creates the xml for a show. """
+        return '<Directory ' + self.attributes(
+            ratingKey = show.rating_key, key = f'/library/metadata/{show.rating_key}/children', type = 'show',
+            title = show.title, guid = f'com.plexapp.agents.thetvdb://{show.tvdb_id}?lang=en', librarySectionID = 1,
+            index = 1, year = show.year, childCount = len(show.seasons),
+            leafCount = sum(x.episodes for x in show.seasons),
+            viewedLeafCount = sum(x.watched for x in show.seasons), updatedAt = 1_600_000_000,
+            lastViewedAt = 1_600_000_000 if any(x.watched for x in show.seasons) else None) + '/>'
+
+    def season_xml(self, show: SyntheticShow, season: SyntheticSeason) -> str:
+        """ Creates the xml for a season. """
+        return '<Directory ' + self.attributes(
+            ratingKey = season.rating_key, key = f'/library/metadata/{season.rating_key}/children', type = 'season',
+            title = f'Season {season.index}', index = season.index, parentRatingKey = show.rating_key,
+            parentTitle = show.title, parentGuid = f'com.plexapp.agents.thetvdb://{show.tvdb_id}?lang=en',
+            leafCount = season.episodes, viewedLeafCount = season.watched, librarySectionID = 1) + '/>'
+
+    def episode_xml(self, show: SyntheticShow, season: SyntheticSeason, number: int) -> str:
+        """ Creates the xml for an episode. """
+        rating_key = season.rating_key * 1000 + number
+        return '<Video ' + self.attributes(
+            ratingKey = rating_key, key = f'/library/metadata/{rating_key}', type = 'episode',
+            title = f'Episode {number + 1}', index = number + 1, parentIndex = season.index,
+            parentRatingKey = season.rating_key, grandparentRatingKey = show.rating_key,
+            grandparentTitle = show.title, viewCount = 1 if number < season.watched else 0,
+            librarySectionID = 1) + '/>'
+
+    def item_xml(self, rating_key: int) -> str:
+        """ Creates the xml for any show, season or episode. """
+        show, season, number = self.items[rating_key]
+        if season is None:
+            return self.show_xml(show)
+        if number is None:
+            return self.season_xml(show, season)
+        return self.episode_xml(show, season, number)
+
+    def route(self, path: str, query: Dict[str, List[str]]) -> Optional[List[str]]:
+        """ Works out the items to respond with for a request.
+
+        :param path: The path of the request.
+        :param query: The query of the request.
+        :return: The xml for each item in the response or None if the path isn't served.
+        """
+        if path in ['/', '/library', '/:/scrobble', '/:/unscrobble']:
+            if path.startswith('/:/'):
+                self.scrobble(int(query['key'][0]), path == '/:/scrobble')
+            return []
+        if path == '/library/sections':
+            return ['<Directory key="1" type="show" title="Anime" agent="com.plexapp.agents.thetvdb" uuid="a"/>']
+        if path == '/library/sections/1/all':
+            if query.get('type', ['2'])[0] == '3':
+                return [self.season_xml(show, season) for show, season in self.library.iter_seasons()]
+            return [self.show_xml(show) for show in self.library.shows]
+
+        match = re.fullmatch(r'/library/metadata/(\d+)(/children)?', path)
+        if match is None or int(match.group(1)) not in self.items:
+            return None
+        if match.group(2):
+            return [self.item_xml(x) for x in self.children.get(int(match.group(1)), [])]
+        return [self.item_xml(int(match.group(1)))]
+
+    def scrobble(self, rating_key: int, watched: bool) -> None:
+        """ Marks a show, season or episode as watched or unwatched.
+
+        :param rating_key: The rating key of the item.
+        :param watched: Whether to mark the item watched or unwatched.
+        :return: None
+        """
+        show, season, number = self.items[rating_key]
+        for x in show.seasons if season is None else [season]:
+            if number is None:
+                x.watched = x.episodes if watched else 0
+            elif watched:
+                # Watching an episode only counts towards the first unwatched episodes
+                x.watched = max(x.watched, number + 1)
+            else:
+                x.watched = min(x.watched, number)
+
+
+class AnilistHandler(StatsHandler):
+    """ Serves the parts of the Anilist GraphQl api used by the sync. """
+
+    def do_GET(self) -> None:
+        self.handle_stats()
+
+    def do_POST(self) -> None:
+        if self.handle_stats():
+            return
+
+        request = json.loads(self.read_body())
+        response = self.server.anilist.respond(request.get('query'), request.get('variables') or {})
+        self.send_body(json.dumps(response).encode(), headers = {'X-RateLimit-Limit': self.server.rate_limit})
+
+
+class AnilistStandin:
+    """ The state behind the Anilist stand-in. Mutations change the users list so later queries see them. """
+
+    def __init__(self, entries: Dict[str, dict]) -> None:
+        """ Prepares the users list.
+
+        :param entries: The users list entries keyed by Anilist id.
+        :return: None
+        """
+        self.entries = entries
+        self.lock = threading.Lock()
+        self.clock = max([x['updatedAt'] for x in entries.values()], default = 0)
+
+    def entry(self, anilist_id: str) -> dict:
+        """ Creates the response for a list entry. """
+        entry = self.entries[anilist_id]
+        return {
+            'id'       : int(anilist_id),
+            'progress' : entry['progress'],
+            'status'   : entry['status'],
+            'updatedAt': entry['updatedAt'],
+            'media'    : {'id'      : int(anilist_id), 'type': 'ANIME', 'status': 'FINISHED', 'season': None,
+                          'episodes': entry['episodes'], 'title': {'romaji': entry['title'], 'english': None}}
+        }
+
+    def respond(self, query: str, variables: dict) -> dict:
+        """ Answers a GraphQl query by recognising which of the sync's queries it is.
+
+        :param query: The GraphQl query.
+        :param variables: The variables for the query.
+        :return: The response to the query.
+        """
+        with self.lock:
+            if 'Viewer' in query:
+                return {'data': {'Viewer': {'name': 'standin'}}}
+
+            if 'MediaListCollection' in query:
+                lists = {}
+                for anilist_id, entry in self.entries.items():
+                    lists.setdefault(entry['status'], []).append(self.entry(anilist_id))
+                return {'data': {'MediaListCollection': {'lists': [
+                    {'name': x, 'status': x, 'isCustomList': False, 'entries': y} for x, y in lists.items()]}}}
+
+            if 'mediaList(' in query:
+                ordered = sorted(self.entries, key = lambda x: -self.entries[x]['updatedAt'])
+                page = variables.get('page', 1)
+                return {'data': {'Page': {'pageInfo' : {'hasNextPage': page * 50 < len(ordered)},
+                                          'mediaList': [self.entry(x) for x in ordered[(page - 1) * 50:page * 50]]}}}
+
+            if 'SaveMediaListEntry' in query:
+                data = {}
+                for alias, number in re.findall(r'(\w+): SaveMediaListEntry \(mediaId: \$mediaId(\d+)', query):
+                    anilist_id = str(variables[f'mediaId{number}'])
+                    self.clock += 1
+                    entry = self.entries.setdefault(anilist_id, {'episodes': None, 'title': anilist_id})
+                    entry.update({'progress' : variables[f'progress{number}'],
+                                  'status'   : variables[f'status{number}'],
+                                  'updatedAt': self.clock})
+                    data[alias] = self.entry(anilist_id)
+                return {'data': data}
+
+        return {'errors': [{'message': 'Unsupported query'}]}
+
+
+class MappingFileHandler(StatsHandler):
+    """ Serves mapping files the way a static file host does, with ETags, conditional requests and byte ranges so that
+    checking for a new version and resuming an interrupted download can be tried out. """
+
+    def do_GET(self) -> None:
+        if self.handle_stats():
+            return
+
+        mapping_files = self.server.mapping_files
+        with mapping_files.lock:
+            file = mapping_files.files.get(urlparse(self.path).path)
+            interrupt_after = mapping_files.interrupt_after
+        if file is None:
+            self.send_body(b'', 404, 'text/plain')
+            return
+
+        body, etag, last_modified = file
+        headers = {'ETag': etag, 'Last-Modified': last_modified, 'Accept-Ranges': 'bytes'}
+        if self.headers.get('If-None-Match') == etag or (self.headers.get('If-None-Match') is None and
+                                                         self.headers.get('If-Modified-Since') == last_modified):
+            self.send_body(b'', 304, headers = headers)
+            return
+
+        status = 200
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range') or '')
+        # A range is only served for the version the client already has part of, otherwise the whole file is sent
+        if match is not None and self.headers.get('If-Range') in [None, etag]:
+            start = int(match.group(1))
+            if start >= len(body):
+                self.send_body(b'', 416, headers = {**headers, 'Content-Range': f'bytes */{len(body)}'})
+                return
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            body = body[start:]
+            status = 206
+
+        if interrupt_after is not None and interrupt_after < len(body):
+            self.send_partial_body(body[:interrupt_after], len(body), status, headers)
+            return
+        self.send_body(body, status, 'application/octet-stream', headers)
+
+    def do_POST(self) -> None:
+        if not self.handle_stats():
+            self.send_body(b'', 405, 'text/plain')
+
+    def send_partial_body(self, body: bytes, length: int, status: int, headers: Dict[str, str]) -> None:
+        """ Sends the start of a response and then drops the connection, as an interrupted download would.
+
+        :param body: The part of the body to send.
+        :param length: The full length of the body.
+        :param status: The status code of the response.
+        :param headers: The headers of the response.
+        :return: None
+        """
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            self.server.stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class MappingFileStandin:
+    """ The state behind the mapping file stand-in. Each file has an ETag made from its contents so replacing a file
+    makes it a new version.
+
+    interrupt_after: The number of bytes to send of each response before dropping the connection, None to send the
+                     whole file.
+    """
+
+    def __init__(self, files: Dict[str, bytes]) -> None:
+        """ Prepares the files to serve.
+
+        :param files: The contents of each file keyed by the path it is served at.
+        :return: None
+        """
+        self.files = {}
+        self.interrupt_after = None
+        self.lock = threading.Lock()
+        for path, body in files.items():
+            self.replace(path, body)
+
+    def replace(self, path: str, body: bytes) -> None:
+        """ Serves a new version of a file.
+
+        :param path: The path the file is served at.
+        :param body: The new contents of the file.
+        :return: None
+        """
+        with self.lock:
+            self.files[path] = (body, f'"{hashlib.sha1(body).hexdigest()}"', formatdate(usegmt = True))
+
+
+def start_plex_standin(library: SyntheticLibrary, port: int = 0,
+                       fixtures_directory: Optional[str] = None) -> ThreadingHTTPServer:
+    """ Starts the Plex stand-in on a background thread.
+
+    :param library: The library to serve.
+    :param port: The port to listen on, 0 for any free port.
+    :param fixtures_directory: A directory of recorded responses to serve instead of the generated ones.
+    :return: The running server.
+    """
+    return start_server(PlexHandler, port, plex = PlexStandin(library, fixtures_directory))
+
+
+def start_anilist_standin(entries: Dict[str, dict], port: int = 0, rate_limit: int = 90) -> ThreadingHTTPServer:
+    """ Starts the Anilist stand-in on a background thread.
+
+    :param entries: The users list entries keyed by Anilist id.
+    :param port: The port to listen on, 0 for any free port.
+    :param rate_limit: The number of requests each minute the stand-in tells the sync it allows.
+    :return: The running server.
+    """
+    return start_server(AnilistHandler, port, anilist = AnilistStandin(entries), rate_limit = str(rate_limit))
+
+
+def start_mapping_standin(directory: str, port: int = 0) -> ThreadingHTTPServer:
+    """ Starts the mapping file stand-in on a background thread. Every file in the directory is served at its name.
+
+    :param directory: The directory holding the mapping files, such as one written by write_mapping_files.
+    :param port: The port to listen on, 0 for any free port.
+    :return: The running server.
+    """
+    files = {}
+    for filename in os.listdir(directory):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            files[f'/{filename}'] = f.read()
+    return start_server(MappingFileHandler, port, mapping_files = MappingFileStandin(files))
+
+
+def start_server(handler, port: int, **state) -> ThreadingHTTPServer:
+    """ Starts a stand-in server on a background thread.
+
+    :param handler: The request handler class for the server.
+    :param port: The port to listen on, 0 for any free port.
+    :param state: Attributes to set on the server for the handler to use.
+    :return: The running server.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.stats = {'requests': 0, 'bytes': 0}
+    server.stats_lock = threading.Lock()
+    for name, value in state.items():
+        setattr(server, name, value)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+def url(server: ThreadingHTTPServer) -> str:
+    """ Gets the url of a running stand-in.
+
+    :param server: The running server.
+    :return: The url of the server.
+    """
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def get_stats(server_url: str) -> Tuple[int, int]:
+    """ Reads the request and byte counts of a stand-in, which may be running in another process.
+
+    :param server_url: The url of the stand-in.
+    :return: The number of requests and bytes served since the last reset.
+    """
+    import requests
+    stats = requests.get(f'{server_url}/_stats').json()
+    return stats['requests'], stats['bytes']
+
+
+def reset_stats(server_url: str) -> None:
+    """ Resets the request and byte counts of a stand-in.
+
+    :param server_url: The url of the stand-in.
+    :return: None
+    """
+    import requests
+    requests.post(f'{server_url}/_reset')
@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from anilist import Anilist
+from config import Account, Config
+from mapping import Mapping
+from metrics import Metrics
+
+
+class SeasonResolution(NamedTuple):
+    """ The Anilist id of a season and the state of that id on the users list. """
+    anilist_id: Optional[str]
+    total_episodes: Optional[int]
+    anilist_progress: Optional[int]
+    anilist_status: Optional[str]
+
+
+@dataclass
+class SyncContext:
+    """ Holds the objects that are shared across a sync run. It is built once by the sync and passed down to anything
+    that needs it. The mapping and Anilist objects are only created the first time they are used so nothing expensive
+    happens until a code path actually needs it.
+
+    When several accounts are synced each gets its own context for its Anilist account and resolved seasons, made with
+    for_account so that the mapping and metrics are shared with the context of the whole run.
+
+    config: The configuration to use for the sync.
+    account: The account being synced or None to sync the single account in the configuration.
+    parent: The context of the whole run when syncing one of several accounts.
+    resolutions: The resolved seasons keyed by tvdb id and season number.
+    """
+    config: Config
+    account: Optional[Account] = None
+    parent: Optional['SyncContext'] = field(default = None, repr = False)
+    resolutions: Dict[Tuple[str, str], SeasonResolution] = field(default_factory = dict, init = False, repr = False)
+
+    @cached_property
+    def metrics(self) -> Metrics:
+        """ The timings and counts recorded during the sync run. """
+        return Metrics() if self.parent is None else self.parent.metrics
+
+    @cached_property
+    def mapping(self) -> Mapping:
+        """ The mapping used to convert tvdb ids into Anilist ids. """
+        if self.parent is not None:
+            return self.parent.mapping
+        return Mapping(self.metrics, self.config.title_matching, self.config.unmapped_max_age,
+                       self.config.tvdb_id_to_anidb_id_url, self.config.anime_offline_database_url)
+
+    @cached_property
+    def anilist(self) -> Anilist:
+        """ The Anilist interface for the access token of the account. Each account has its own rate limiter. """
+        token = self.config.anilist_access_token if self.account is None else self.account.anilist_access_token
+        return Anilist(token, self.config.anilist_api_url, user_list_cache_path = self.data_path('anilist_user_list'),
+                       metrics = self.metrics)
+
+    @property
+    def plex_token(self) -> str:
+        """ The Plex token to read the watch state of the account with. """
+        if self.account is None or self.account.plex_token is None:
+            return self.config.server_token
+        return self.account.plex_token
+
+    def data_path(self, name: str) -> str:
+        """ Gets the path of a json file in the data directory that belongs to the account being synced.
+
+        :param name: The name of the file without its extension.
+        :return: The path of the file.
+        """
+        return f'data/{name}.json' if self.account is None else f'data/{name}_{self.account.name}.json'
+
+    def for_account(self, account: Account) -> 'SyncContext':
+        """ Creates the context to sync one of several accounts, sharing the mapping and metrics of this context.
+
+        :param account: The account to sync.
+        :return: The context for the account.
+        """
+        return SyncContext(self.config, account, self)
+
+    def resolve(self, anime) -> SeasonResolution:
+        """ Resolves the Anilist id of a season and looks it up on the users list. Each season is only resolved once
+        per sync and the result is shared by every anime for the same season, such as the same show in two libraries.
+        Seasons without an Anilist id are added to the mapping errors the first time they are resolved.
+
+        :param anime: The anime for the season.
+        :return: The resolution for the season.
+        """
+        key = (anime.tvdb_id, anime.season_number)
+        if (resolution := self.resolutions.get(key)) is not None:
+            self.metrics.count('resolve.cache.hits')
+            return resolution
+
+        self.metrics.count('resolve.cache.misses')
+        anilist_id = self.mapping.get_anilist_id(anime.tvdb_id, anime.title, anime.season_number, anime.year,
+                                                 anime.episodes)
+        if anilist_id is None:
+            self.mapping.add_to_mapping_errors(anime)
+
+        entry = self.anilist.get_anime(anilist_id) or {}
+        resolution = SeasonResolution(anilist_id, (entry.get('media') or {}).get('episodes'), entry.get('progress'),
+                                      entry.get('status'))
+        self.resolutions[key] = resolution
+        return resolution
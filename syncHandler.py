@@ -1,45 +1,350 @@
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
 
 import coloredlogs
 from plexapi.exceptions import BadRequest
 from requests.exceptions import ConnectionError
 
-from anilist import Anilist
-from mapping import Mapping
-from plexConnection import PlexConnection
+from checkpoint import Checkpoint
 from config import Config
+from plexConnection import PlexConnection, PlexSeason
+from reverseSync import apply_reverse_sync, describe_reverse_sync, plan_reverse_sync
+from anime import Anime
+from syncContext import SyncContext
+from syncPipeline import SyncPipeline
+from syncPlan import SyncPlan
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
 
-config = Config()
+# The number of changes sent to Anilist between writes to the log of sent changes
+CHECKPOINT_BATCH_SIZE = 100
 
+# Held while a sync runs so that syncs started by webhooks never overlap the daily sync
+sync_lock = threading.Lock()
 
-def start_sync():
-    logger.debug("Sync started!")
-    # Clear mapping errors
-    Mapping().save_mapping_errors({})
 
+def connect_to_plex(context: SyncContext) -> PlexConnection:
+    """ Connects to the configured Plex server as the Plex user of the context, converting connection failures into the
+    errors the program handles.
+
+    :param context: The context of the sync to connect for.
+    :return: The connection to the Plex server.
+    """
+    config = context.config
     try:
-        plex_connection = PlexConnection(config.server_url, config.server_token)
+        with context.metrics.stage('plex.connect'):
+            return PlexConnection(config.server_url, context.plex_token, config.scan_workers, len(config.libraries),
+                                  context.metrics, context.data_path('plex_scan_cache'))
     except ConnectionError:
         raise PlexConnection.PlexServerUnreachable(f"Unable to reach Plex server at {config.server_url}")
     except BadRequest:
         raise PlexConnection.InvalidPlexToken(f"Invalid Plex token provided.")
 
-    plex_anime = plex_connection.get_anime(config.libraries[0])
 
-    # Check anime that are out of sync with anilist
-    logger.debug("Checking for any required updates")
-    for anime in plex_anime:
-        if anime.update_required():
-            anime.update_on_anilist()
+def load_checkpoint(context: SyncContext, dry_run: bool = False) -> Checkpoint:
+    """ Loads the checkpoint of the last run of an account if it didn't finish. Dry runs never continue or leave a
+    checkpoint.
+
+    :param context: The context of the account to sync.
+    :param dry_run: Whether the sync is a dry run.
+    :return: The checkpoint to continue from.
+    """
+    if dry_run:
+        return Checkpoint(None)
+    return Checkpoint.load(context.data_path('sync_checkpoint'), context.config.checkpoint_max_age)
+
+
+def sync_account(context: SyncContext, checkpoint: Checkpoint, full: bool = False, dry_run: bool = False) -> SyncPlan:
+    """ Syncs the watch state of the Plex user of a context to their Anilist account. The changes needed are planned
+    before they are sent and the plan is saved to the data directory.
+
+    Progress is saved to the checkpoint as the run goes. When the checkpoint is from an earlier run that failed the
+    sync continues from it, skipping the scan if it finished and only sending the changes that weren't confirmed if
+    the plan was made.
+
+    :param context: The context of the account to sync.
+    :param checkpoint: The checkpoint to continue from and save progress to.
+    :param full: Whether to rescan every show in Plex instead of only the ones that have changed since the last sync.
+    :param dry_run: Whether to only plan and print the changes without sending them to Anilist.
+    :return: The plan of changes for the account.
+    """
+    config = context.config
+    plex_connection = None
+    if checkpoint.plan is not None:
+        plan = checkpoint.plan
+        logger.info(f"Continuing the last sync with {len(plan.pending)} of {len(plan.changes)} changes left to send")
+    else:
+        plan = SyncPlan()
+        if checkpoint.seasons is not None:
+            logger.info(f"Continuing the last sync using the {len(checkpoint.seasons)} seasons it scanned")
+            plan.add_anime(create_anime(context, checkpoint.seasons))
+
+        elif config.sync_mode == 'pipeline':
+            logger.debug("Scanning and updating using the sync pipeline")
+            plex_connection = connect_to_plex(context)
+            with context.metrics.stage('pipeline'):
+                asyncio.run(SyncPipeline(plex_connection, context, plan, full, dry_run).run())
+            plex_connection.scan_cache.save()
+
+        else:
+            plex_connection = connect_to_plex(context)
+            checkpoint.seasons = plex_connection.scan_libraries(config.libraries, config.scan_mode, full)
+            plex_connection.scan_cache.save()
+            checkpoint.save()
+            plex_anime = create_anime(context, checkpoint.seasons)
+
+            # Check anime that are out of sync with anilist
+            logger.debug("Checking for any required updates")
+            with context.metrics.stage('plan'):
+                plan.add_anime(plex_anime)
+
+        # Go through the list and mark any shows that will have all their episodes watched as completed
+        logger.debug("Fixing leftover completed shows")
+        with context.metrics.stage('plan'):
+            plan.add_leftover_completed(context.anilist.user_list)
+        context.metrics.add_items('plan', len(plan.changes))
+        checkpoint.plan = plan
+        checkpoint.save()
+
+    if dry_run:
+        logger.info(plan.describe())
+    else:
+        apply_with_checkpoints(context, plan, checkpoint)
+
+    if config.reverse_sync:
+        sync_to_plex(context, plex_connection or connect_to_plex(context), dry_run)
+    plan.save(context.data_path('sync_plan'))
+
+    checkpoint.clear()
+    return plan
+
+
+def create_anime(context: SyncContext, seasons: List[PlexSeason]) -> List[Anime]:
+    """ Creates the anime for the seasons found by a scan, resolving their Anilist ids.
+
+    :param context: The context of the account being synced.
+    :param seasons: The seasons found by the scan.
+    :return: The anime for the seasons.
+    """
+    with context.metrics.stage('resolve'):
+        anime = [Anime(*season, context) for season in seasons]
+    context.metrics.add_items('resolve', len(anime))
+    return anime
+
+
+def sync_to_plex(context: SyncContext, plex_connection: PlexConnection, dry_run: bool = False) -> None:
+    """ Marks episodes watched in Plex for seasons that are further along on Anilist, such as ones watched on another
+    device and tracked on Anilist.
+
+    :param context: The context of the account being synced.
+    :param plex_connection: The connection to the Plex server holding the results of the last scan.
+    :param dry_run: Whether to only print the changes without making them.
+    :return: None
+    """
+    logger.debug("Checking for seasons that are behind Anilist in Plex")
+    changes = plan_reverse_sync(plex_connection.scan_cache, context.anilist.user_list, context.mapping,
+                                context.config.reverse_sync_title_matches)
+    if dry_run:
+        logger.info(describe_reverse_sync(changes))
+    else:
+        apply_reverse_sync(plex_connection, changes, context.metrics)
+
+
+def apply_with_checkpoints(context: SyncContext, plan: SyncPlan, checkpoint: Checkpoint) -> None:
+    """ Sends the changes in a plan that haven't been sent yet, logging the sent changes to the checkpoint after each
+    batch of changes so a failed run only has to send the changes from the batch it failed in again.
+
+    :param context: The context of the account being synced.
+    :param plan: The plan to send.
+    :param checkpoint: The checkpoint holding the plan.
+    :return: None
+    """
+    pending = plan.pending
+    for start in range(0, len(pending), CHECKPOINT_BATCH_SIZE):
+        batch = pending[start:start + CHECKPOINT_BATCH_SIZE]
+        plan.apply(context, batch)
+        checkpoint.record_sent(batch)
+
+
+def start_sync(full: bool = False, dry_run: bool = False) -> SyncPlan:
+    """ Syncs the watch state of the configured Plex libraries to Anilist.
+
+    :param full: Whether to rescan every show in Plex instead of only the ones that have changed since the last sync.
+    :param dry_run: Whether to only plan and print the changes without sending them to Anilist.
+    :return: The plan of changes for the sync.
+    """
+    logger.debug("Sync started!")
+    context = SyncContext(Config())
+    checkpoint = load_checkpoint(context, dry_run)
+
+    # Clear mapping errors, unless continuing a run that has already found them
+    if checkpoint.plan is None:
+        context.mapping.save_mapping_errors({})
+
+    try:
+        context.mapping.refresh_unmapped_seasons()
+        plan = sync_account(context, checkpoint, full, dry_run)
+    finally:
+        # Save the mappings and users list changes made so far even if the sync failed
+        context.mapping.flush()
+        context.anilist.flush()
+        report_metrics(context)
+
+    logger.debug("Sync complete!\n")
+    return plan
+
+
+def get_account_contexts(context: SyncContext) -> List[SyncContext]:
+    """ Creates the context of each configured account. Accounts given as the name of a Plex user are given a token
+    for that user using the server token.
+
+    :param context: The context of the whole run.
+    :return: The contexts of the accounts.
+    """
+    accounts = context.config.accounts
+    if any(x.plex_user is not None and x.plex_token is None for x in accounts):
+        owner_connection = connect_to_plex(context)
+        accounts = [x._replace(plex_token = owner_connection.get_user_token(x.plex_user))
+                    if x.plex_user is not None and x.plex_token is None else x for x in accounts]
+
+    return [context.for_account(x) for x in accounts]
+
+
+def start_account_syncs(full: bool = False, dry_run: bool = False) -> Dict[str, SyncPlan]:
+    """ Syncs several Plex users to their own Anilist accounts at the same time. The mapping is loaded once and shared
+    by every account while each account scans its own watch state, which after the first sync only fetches the shows
+    that user has watched since, and talks to Anilist with its own rate limiter. An account failing to sync doesn't
+    stop the others.
 
-    # Go through the list and mark any shows that have all their episodes watched as completed
-    logger.debug("Fixing leftover completed shows")
-    anilist = Anilist(config.anilist_access_token)
-    for id, data in anilist.user_list.items():
-        if data.get('progress') == data.get('media').get('episodes') and data.get('status') != 'COMPLETED':
-            anilist.update_series(id, data.get('progress'), 'COMPLETED')
+    :param full: Whether to rescan every show in Plex instead of only the ones that have changed since the last sync.
+    :param dry_run: Whether to only plan and print the changes without sending them to Anilist.
+    :return: The plan of changes for each account that synced keyed by the name of the account.
+    """
+    context = SyncContext(Config())
+    logger.debug(f"Sync started for {len(context.config.accounts)} accounts!")
+
+    account_contexts = get_account_contexts(context)
+    checkpoints = [load_checkpoint(x, dry_run) for x in account_contexts]
+
+    # Clear mapping errors, unless continuing a run that has already found them
+    if all(x.plan is None for x in checkpoints):
+        context.mapping.save_mapping_errors({})
+
+    plans = {}
+    try:
+        context.mapping.refresh_unmapped_seasons()
+        with context.metrics.stage('accounts'), ThreadPoolExecutor(max_workers = len(account_contexts)) as executor:
+            futures = {x.account.name: executor.submit(sync_account, x, checkpoint, full, dry_run)
+                       for x, checkpoint in zip(account_contexts, checkpoints)}
+
+        for name, future in futures.items():
+            try:
+                plans[name] = future.result()
+            except Exception as e:
+                logger.error(f"An error occurred syncing account {name}: {e}")
+        context.metrics.add_items('accounts', len(plans))
+
+    finally:
+        # Save the mappings and users list changes made so far even if the sync failed
+        context.mapping.flush()
+        for account_context in account_contexts:
+            account_context.anilist.flush()
+        report_metrics(context)
 
     logger.debug("Sync complete!\n")
+    return plans
+
+
+def sync_shows(show_seasons: Dict[str, Optional[Set[str]]], plex_user: Optional[str] = None) -> List[SyncPlan]:
+    """ Syncs the watch state of some seasons of some shows to Anilist, such as the ones affected by a webhook. Only
+    the affected seasons are scanned and the scan cache is left alone so the daily sync still checks the shows.
+
+    :param show_seasons: The season numbers to sync keyed by the rating key of their show. A value of None syncs every
+                         season of the show.
+    :param plex_user: The Plex user that watched the seasons. When several accounts are configured only the accounts
+                      with this Plex user or name are synced.
+    :return: The plans of changes made for each account synced.
+    """
+    context = SyncContext(Config())
+    plans = []
+    account_contexts = []
+    with sync_lock:
+        try:
+            if not context.config.accounts:
+                account_contexts = [context]
+            else:
+                account_contexts = [x for x in get_account_contexts(context)
+                                    if plex_user in (x.account.plex_user, x.account.name)]
+
+            for account_context in account_contexts:
+                plans.append(sync_account_shows(account_context, show_seasons))
+        finally:
+            context.mapping.flush()
+            for account_context in account_contexts:
+                account_context.anilist.flush()
+
+    return plans
+
+
+def sync_account_shows(context: SyncContext, show_seasons: Dict[str, Optional[Set[str]]]) -> SyncPlan:
+    """ Syncs the watch state of some seasons of some shows for the Plex user of a context.
+
+    :param context: The context of the account to sync.
+    :param show_seasons: The season numbers to sync keyed by the rating key of their show. A value of None syncs every
+                         season of the show.
+    :return: The plan of changes made.
+    """
+    plan = SyncPlan()
+    plex_connection = connect_to_plex(context)
+    seasons = []
+    for rating_key, season_numbers in show_seasons.items():
+        show = plex_connection.fetchItem(int(rating_key))
+        seasons.extend(x for x in plex_connection.scan_show(show)
+                       if season_numbers is None or x.season_number in season_numbers)
+
+    anime = [Anime(*season, context) for season in seasons]
+    plan.add_anime(anime)
+    # Only the shows that were synced need checking for being completed
+    anilist_ids = {x.anilist_id for x in anime}
+    plan.add_leftover_completed({k: v for k, v in context.anilist.user_list.items() if k in anilist_ids})
+    logger.info(plan.describe())
+    plan.apply(context)
+    return plan
+
+
+def report_metrics(context: SyncContext) -> None:
+    """ Logs a summary of the timings and counts of a sync and writes them to the configured metrics files.
+
+    :param context: The context of the sync.
+    :return: None
+    """
+    logger.info(context.metrics.describe())
+    if context.config.metrics_json_path:
+        context.metrics.save_json(context.config.metrics_json_path)
+    if context.config.metrics_prometheus_path:
+        context.metrics.save_prometheus(context.config.metrics_prometheus_path)
+
+
+def apply_saved_plan() -> None:
+    """ Sends the changes in the last saved plan of each account that haven't been sent yet, such as the plans from a
+    dry run.
+
+    :return: None
+    """
+    context = SyncContext(Config())
+    account_contexts = [context.for_account(x) for x in context.config.accounts] or [context]
+    try:
+        for account_context in account_contexts:
+            plan = SyncPlan.load(account_context.data_path('sync_plan'))
+            logger.info(plan.describe())
+            plan.apply(account_context)
+            plan.save(account_context.data_path('sync_plan'))
+    finally:
+        context.mapping.flush()
+        for account_context in account_contexts:
+            account_context.anilist.flush()
+        report_metrics(context)
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import coloredlogs
+
+from anime import Anime
+from plexConnection import PlexConnection, PlexSeason
+from syncContext import SyncContext
+from syncPlan import PlannedChange, SyncPlan
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+# Marks the end of the items passed through a queue
+DONE = None
+
+# The number of seconds between checks for more changes while a batch of updates is being collected
+POLL_INTERVAL = 0.05
+
+
+class SyncPipeline:
+    """ Runs the sync as three concurrent stages connected by bounded queues so that scanning Plex, resolving Anilist
+    ids and sending updates to Anilist overlap instead of running one after another.
+
+    The Plex and Anilist clients are blocking so each stage runs its work on its own thread pool. Resolving uses a
+    single thread because the mapping files are written as new mappings are created.
+    """
+
+    def __init__(self, plex_connection: PlexConnection, context: SyncContext, plan: SyncPlan, full: bool = False,
+                 dry_run: bool = False, queue_size: int = 100, batch_size: int = 20,
+                 batch_delay: float = 1.0) -> None:
+        """ Prepares the pipeline.
+
+        :param plex_connection: The connection to the Plex server to scan.
+        :param context: The context of the current sync run.
+        :param plan: The plan to record the changes made by the pipeline in.
+        :param full: Whether to rescan every show instead of only the ones that have changed.
+        :param dry_run: Whether to only plan the changes without sending them to Anilist.
+        :param queue_size: The maximum number of items waiting between two stages.
+        :param batch_size: The maximum number of updates to send to Anilist in one request.
+        :param batch_delay: The number of seconds to keep collecting changes for a batch before it is sent.
+        :return: None
+        """
+        self.plex_connection = plex_connection
+        self.context = context
+        self.plan = plan
+        self.full = full
+        self.dry_run = dry_run
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.plex_executor = ThreadPoolExecutor(max_workers = plex_connection.scan_workers)
+        self.resolve_executor = ThreadPoolExecutor(max_workers = 1)
+        self.anilist_executor = ThreadPoolExecutor(max_workers = 1)
+
+    async def run(self) -> None:
+        """ Runs all the stages of the pipeline until every season has been scanned and every update sent.
+
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        seasons = asyncio.Queue(maxsize = self.queue_size)
+        updates = asyncio.Queue(maxsize = self.queue_size)
+
+        try:
+            # Load the users list before any of the stages need it
+            await loop.run_in_executor(self.anilist_executor, lambda: self.context.anilist.user_list)
+            await asyncio.gather(self.scan(seasons), self.resolve(seasons, updates), self.update(updates))
+        finally:
+            for executor in [self.plex_executor, self.resolve_executor, self.anilist_executor]:
+                executor.shutdown(wait = False)
+
+    async def scan(self, seasons: asyncio.Queue) -> None:
+        """ The first stage. Puts the seasons of every show in the configured libraries on the queue using the
+        configured scan mode. The bulk and stream modes list the seasons of a whole library in a few requests so each
+        library is passed on once it has been listed, while the serial and parallel modes pass on the seasons of each
+        show as it is scanned. Shows that haven't changed since the last scan are taken from the scan cache.
+
+        :param seasons: The queue to put the scanned seasons on.
+        :return: None
+        """
+        if self.context.config.scan_mode in ['bulk', 'stream']:
+            await self.scan_libraries(seasons)
+        else:
+            for library in self.context.config.libraries:
+                await self.scan_shows(library, seasons)
+
+        await seasons.put(DONE)
+
+    async def scan_libraries(self, seasons: asyncio.Queue) -> None:
+        """ Lists the seasons of every library at once using the section wide bulk or stream scan.
+
+        :param seasons: The queue to put the scanned seasons on.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        plex_connection = self.plex_connection
+        scans = [loop.run_in_executor(self.plex_executor, plex_connection.scan_library, library,
+                                      self.context.config.scan_mode, self.full)
+                 for library in self.context.config.libraries]
+        for scan in asyncio.as_completed(scans):
+            for season in await scan:
+                await seasons.put(season)
+
+    async def scan_shows(self, library: str, seasons: asyncio.Queue) -> None:
+        """ Scans the shows of a library one at a time using the serial or parallel scan, keeping as many shows in
+        flight as there are scan workers.
+
+        :param library: The name of the library to scan.
+        :param seasons: The queue to put the scanned seasons on.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        plex_connection = self.plex_connection
+
+        async def scan_show(show) -> None:
+            show_seasons = await loop.run_in_executor(self.plex_executor, plex_connection.scan_show, show)
+            plex_connection.scan_cache.update(show, show_seasons)
+            for season in show_seasons:
+                await seasons.put(season)
+
+        shows = await loop.run_in_executor(self.plex_executor, plex_connection.get_shows, library)
+        pending = set()
+        for show in shows:
+            cached = None if self.full else plex_connection.scan_cache.get_seasons(show)
+            if not self.full:
+                self.context.metrics.count('plex.scan_cache.misses' if cached is None else 'plex.scan_cache.hits')
+            if cached is not None:
+                for season in cached:
+                    await seasons.put(season)
+                continue
+
+            if len(pending) >= plex_connection.scan_workers:
+                finished, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    task.result()
+            pending.add(asyncio.ensure_future(scan_show(show)))
+
+        if pending:
+            for task in (await asyncio.wait(pending))[0]:
+                task.result()
+
+    async def resolve(self, seasons: asyncio.Queue, updates: asyncio.Queue) -> None:
+        """ The second stage. Resolves the Anilist id of each scanned season and plans the change for the ones that need
+        to be updated. A season that appears in more than one library is only planned again if it has more watched
+        episodes.
+
+        :param seasons: The queue to take scanned seasons from.
+        :param updates: The queue to put planned changes on.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        watched = {}
+        while (season := await seasons.get()) is not DONE:
+            key = (season.tvdb_id, season.season_number)
+            if key in watched and season.watched_episodes <= watched[key]:
+                continue
+            watched[key] = season.watched_episodes
+
+            anime = await loop.run_in_executor(self.resolve_executor, self.create_anime, season)
+            self.context.metrics.add_items('resolve', 1)
+            if (change := PlannedChange.from_anime(anime)) is not None:
+                self.plan.add(change)
+                await updates.put(self.plan.changes[change.anilist_id])
+
+        await updates.put(DONE)
+
+    def create_anime(self, season: PlexSeason) -> Anime:
+        """ Creates the anime for a scanned season which resolves its Anilist id and current Anilist state.
+
+        :param season: The scanned season.
+        :return: The anime for the season.
+        """
+        with self.context.metrics.stage('resolve'):
+            return Anime(*season, self.context)
+
+    async def update(self, updates: asyncio.Queue) -> None:
+        """ The last stage. Sends the planned changes to Anilist in batches. After the first change of a batch arrives
+        the batch keeps collecting changes for up to the batch delay so that changes resolved close together share a
+        request, and is sent early once it is full. Nothing is sent on a dry run.
+
+        :param updates: The queue to take planned changes from.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            batch = []
+            change = await updates.get()
+            deadline = loop.time() + self.batch_delay
+            while change is not DONE:
+                # A change merged with a later one is sent once with the merged values
+                if change.successful is None and change not in batch:
+                    batch.append(change)
+                if len(batch) >= self.batch_size:
+                    break
+
+                # Poll rather than cancel a pending get on timeout so no change can be dropped from the queue
+                while updates.empty() and loop.time() < deadline:
+                    await asyncio.sleep(POLL_INTERVAL)
+                if updates.empty():
+                    break
+                change = updates.get_nowait()
+            done = change is DONE
+
+            if batch and not self.dry_run:
+                await loop.run_in_executor(self.anilist_executor, self.plan.apply, self.context, batch)
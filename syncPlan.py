@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import coloredlogs
+
+import utils
+from anime import Anime
+from syncContext import SyncContext
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+
+@dataclass
+class PlannedChange:
+    """ A single change that needs to be made to the users list on Anilist.
+
+    anilist_id: The id of the show to change.
+    progress: The progress to set.
+    status: The status to set.
+    kind: 'add' for a show that isn't on the list yet, 'progress' for more watched episodes or 'status' for a status
+          change on its own.
+    reason: Why the change is needed.
+    title: The title of the show in Plex, if the change came from Plex.
+    tvdb_id: The tvdb id of the show in Plex, if the change came from Plex.
+    season_number: The season of the show in Plex, if the change came from Plex.
+    successful: None until the change has been sent, then whether or not Anilist accepted it.
+    """
+    anilist_id: str
+    progress: int
+    status: str
+    kind: str
+    reason: str
+    title: Optional[str] = None
+    tvdb_id: Optional[str] = None
+    season_number: Optional[str] = None
+    successful: Optional[bool] = None
+
+    @property
+    def name(self) -> str:
+        """ A readable name for the show being changed. """
+        return self.anilist_id if self.title is None else f"{self.title} Season {self.season_number}"
+
+    def to_json(self) -> dict:
+        """ Converts the change into a json serialisable dictionary. The fields are copied directly rather than with
+        dataclasses.asdict, which deep copies every value and makes saving large plans slow.
+
+        :return: The change as a dictionary.
+        """
+        return {'anilist_id'   : self.anilist_id,
+                'progress'     : self.progress,
+                'status'       : self.status,
+                'kind'         : self.kind,
+                'reason'       : self.reason,
+                'title'        : self.title,
+                'tvdb_id'      : self.tvdb_id,
+                'season_number': self.season_number,
+                'successful'   : self.successful}
+
+    @staticmethod
+    def from_anime(anime: Anime) -> Optional['PlannedChange']:
+        """ Works out the change needed to bring Anilist in line with an anime in Plex.
+
+        :param anime: The anime to plan the change for.
+        :return: The change needed or None if the anime is already up to date.
+        """
+        if not anime.update_required():
+            return None
+
+        if anime.anilist_status is None:
+            kind = 'add'
+            reason = f"Not on the list, {anime.watched_episodes} episodes watched in Plex"
+        elif anime.anilist_progress is None or anime.watched_episodes > anime.anilist_progress:
+            kind = 'progress'
+            reason = f"{anime.watched_episodes} episodes watched in Plex, progress is {anime.anilist_progress}"
+        else:
+            kind = 'status'
+            reason = f"Status is {anime.anilist_status}, Plex watch state is {anime.status}"
+
+        return PlannedChange(anime.anilist_id, anime.watched_episodes, anime.status, kind, reason, anime.title,
+                             anime.tvdb_id, anime.season_number)
+
+
+@dataclass
+class SyncPlan:
+    """ The full set of changes a sync will make to Anilist, worked out before any of them are sent. Changes are kept
+    per Anilist id so that several changes to the same show in one run are merged into a single update.
+
+    changes: The planned changes keyed by Anilist id.
+    created_at: The unix time the plan was created.
+    lock: Held while changes are merged or marked as sent, as the sync pipeline sends changes on another thread while
+          it is still adding them.
+    """
+    changes: Dict[str, PlannedChange] = field(default_factory = dict)
+    created_at: float = field(default_factory = time.time)
+    lock: threading.Lock = field(default_factory = threading.Lock, init = False, repr = False, compare = False)
+
+    def add(self, change: PlannedChange) -> None:
+        """ Adds a change to the plan, merging it with any change already planned for the same show. The merged change
+        keeps the highest progress along with the status of the change it came from, taking the latest status when the
+        progress is the same, and needs to be sent again even if the earlier one was sent.
+
+        :param change: The change to add.
+        :return: None
+        """
+        with self.lock:
+            existing = self.changes.get(change.anilist_id)
+            if existing is None:
+                self.changes[change.anilist_id] = change
+                return
+
+            if change.progress >= existing.progress:
+                existing.progress = change.progress
+                existing.status = change.status
+            existing.reason = f'{existing.reason}; {change.reason}'
+            existing.successful = None
+            if existing.kind == 'status':
+                existing.kind = change.kind
+
+    def add_anime(self, anime: Iterable[Anime]) -> None:
+        """ Plans the changes needed for each anime in Plex.
+
+        :param anime: The anime from Plex.
+        :return: None
+        """
+        for x in anime:
+            if (change := PlannedChange.from_anime(x)) is not None:
+                self.add(change)
+
+    def add_leftover_completed(self, user_list: dict) -> None:
+        """ Plans marking any show as completed that will have all its episodes watched once the planned changes are
+        made.
+
+        :param user_list: The users list from Anilist.
+        :return: None
+        """
+        for anilist_id, data in user_list.items():
+            planned = self.changes.get(anilist_id)
+            pending = planned is not None and planned.successful is None
+            progress = planned.progress if pending else data.get('progress')
+            status = planned.status if pending else data.get('status')
+
+            if progress == data.get('media').get('episodes') and status != 'COMPLETED':
+                self.add(PlannedChange(anilist_id, progress, 'COMPLETED', 'status',
+                                       f"All {progress} episodes watched but status is {status}"))
+
+    @property
+    def pending(self) -> List[PlannedChange]:
+        """ The changes that haven't been sent yet. """
+        return [x for x in self.changes.values() if x.successful is None]
+
+    def apply(self, context: SyncContext, changes: Optional[List[PlannedChange]] = None) -> None:
+        """ Sends changes to Anilist in batches. Changes that came from Plex and fail are added to the mapping errors.
+
+        :param context: The context of the current sync run.
+        :param changes: The changes to send, defaults to every change that hasn't been sent yet.
+        :return: None
+        """
+        changes = self.pending if changes is None else changes
+        for change in changes:
+            logger.info(f"Updating {change.name} on Anilist")
+
+        # The values are copied as the changes can be merged with new ones while they are being sent
+        with self.lock:
+            updates = [(x.anilist_id, x.progress, x.status) for x in changes]
+        with context.metrics.stage('anilist.update'):
+            results = context.anilist.update_series_batch(updates)
+        context.metrics.add_items('anilist.update', len(updates))
+
+        for change, (_, progress, status), successful in zip(changes, updates, results):
+            with self.lock:
+                # A change merged while it was being sent still needs the merged values sending
+                if (change.progress, change.status) != (progress, status):
+                    continue
+                change.successful = successful
+            if not successful:
+                logger.info(f"Update failed. Anilist id {change.anilist_id} for {change.name} invalid")
+                if change.tvdb_id is not None:
+                    context.mapping.add_to_mapping_errors(change)
+
+    def describe(self) -> str:
+        """ Describes the planned changes in a readable form for a dry run.
+
+        :return: One line for each planned change.
+        """
+        lines = [f"{len(self.changes)} planned changes"]
+        for change in self.changes.values():
+            lines.append(f"  {change.kind:<8} {change.name} ({change.anilist_id}) -> {change.status} "
+                         f"{change.progress}: {change.reason}")
+        return '\n'.join(lines)
+
+    def to_json(self) -> dict:
+        """ Converts the plan into a json serialisable dictionary.
+
+        :return: The plan as a dictionary.
+        """
+        return {'created_at': self.created_at, 'changes': [x.to_json() for x in self.changes.values()]}
+
+    @staticmethod
+    def from_json(data: dict) -> 'SyncPlan':
+        """ Creates a plan from a dictionary created by to_json.
+
+        :param data: The plan as a dictionary.
+        :return: The plan.
+        """
+        changes = [PlannedChange(**x) for x in data.get('changes', [])]
+        return SyncPlan({x.anilist_id: x for x in changes}, data.get('created_at', time.time()))
+
+    def save(self, filepath: str) -> None:
+        """ Saves the plan to a json file.
+
+        :param filepath: The file path to save the plan to.
+        :return: None
+        """
+        utils.save_json(self.to_json(), filepath)
+
+    @staticmethod
+    def load(filepath: str) -> 'SyncPlan':
+        """ Loads a plan from a json file.
+
+        :param filepath: The file path of the plan.
+        :return: The plan.
+        """
+        return SyncPlan.from_json(utils.load_json(filepath))
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+import mapping
+import standins
+import utils
+
+
+class DownloadMappingFileTest(unittest.TestCase):
+    """ Tests downloading the mapping files against the mapping file stand-in. """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        source = os.path.join(self.directory.name, 'source')
+        os.mkdir(source)
+        with open(os.path.join(source, 'mapping.xml'), 'wb') as f:
+            f.write(b'a' * 100_000)
+
+        self.server = standins.start_mapping_standin(source)
+        self.standin = self.server.mapping_files
+        self.server_url = standins.url(self.server)
+        self.url = f'{self.server_url}/mapping.xml'
+        self.filepath = os.path.join(self.directory.name, 'mapping.xml')
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def read(self, filepath: str = None) -> bytes:
+        with open(filepath or self.filepath, 'rb') as f:
+            return f.read()
+
+    def interrupted_download(self, after: int) -> None:
+        """ Starts a download that the stand-in drops after a number of bytes. """
+        self.standin.interrupt_after = after
+        with self.assertRaises(mapping.requests.exceptions.RequestException):
+            mapping.download_mapping_file(self.filepath, self.url)
+        self.standin.interrupt_after = None
+        standins.reset_stats(self.server_url)
+
+    def test_download(self) -> None:
+        self.assertTrue(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'a' * 100_000)
+        self.assertEqual(mapping.load_download_metadata(self.filepath)['etag'], self.standin.files['/mapping.xml'][1])
+        self.assertFalse(os.path.exists(f'{self.filepath}.part'))
+
+    def test_unchanged_file_is_not_downloaded_again(self) -> None:
+        mapping.download_mapping_file(self.filepath, self.url)
+        standins.reset_stats(self.server_url)
+
+        self.assertFalse(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(standins.get_stats(self.server_url), (1, 0))
+        self.assertEqual(self.read(), b'a' * 100_000)
+
+    def test_changed_file_is_downloaded(self) -> None:
+        mapping.download_mapping_file(self.filepath, self.url)
+        self.standin.replace('/mapping.xml', b'b' * 50_000)
+
+        self.assertTrue(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'b' * 50_000)
+
+    def test_interrupted_download_is_resumed(self) -> None:
+        self.interrupted_download(70_000)
+        partial_size = os.path.getsize(f'{self.filepath}.part')
+        self.assertGreater(partial_size, 0)
+
+        self.assertTrue(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'a' * 100_000)
+        # Only the rest of the file is sent
+        self.assertEqual(standins.get_stats(self.server_url), (1, 100_000 - partial_size))
+
+    def test_file_changed_while_resuming_is_downloaded_again(self) -> None:
+        self.interrupted_download(70_000)
+        self.standin.replace('/mapping.xml', b'b' * 80_000)
+
+        self.assertTrue(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'b' * 80_000)
+
+    def test_unsatisfiable_range_starts_again(self) -> None:
+        self.interrupted_download(70_000)
+        # The partial file is already as long as the file on the server
+        with open(f'{self.filepath}.part', 'wb') as f:
+            f.write(b'a' * 100_000)
+
+        self.assertTrue(mapping.download_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'a' * 100_000)
+        self.assertFalse(os.path.exists(f'{self.filepath}.part'))
+
+    def test_failed_update_keeps_existing_copy(self) -> None:
+        mapping.download_mapping_file(self.filepath, self.url)
+        # Make the last check old enough for the file to be checked again
+        metadata = mapping.load_download_metadata(self.filepath)
+        utils.save_json({**metadata, 'checked_at': 0}, f'{self.filepath}.meta.json')
+        self.standin.replace('/mapping.xml', b'b' * 100_000)
+        self.standin.interrupt_after = 10_000
+
+        self.assertFalse(mapping.update_mapping_file(self.filepath, self.url))
+        self.assertEqual(self.read(), b'a' * 100_000)
+
+    def test_missing_file_keeps_existing_copy(self) -> None:
+        mapping.download_mapping_file(self.filepath, self.url)
+        metadata = mapping.load_download_metadata(self.filepath)
+        utils.save_json({**metadata, 'checked_at': 0}, f'{self.filepath}.meta.json')
+
+        self.assertFalse(mapping.update_mapping_file(self.filepath, f'{self.server_url}/missing.xml'))
+        self.assertEqual(self.read(), b'a' * 100_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
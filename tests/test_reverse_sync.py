@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import standins
+from mapping import Mapping
+from metrics import Metrics
+from plexConnection import PlexConnection
+from reverseSync import apply_reverse_sync, plan_reverse_sync
+
+
+class ReverseSyncTest(unittest.TestCase):
+    """ Tests marking episodes watched in the Plex stand-in from progress on Anilist. """
+
+    def setUp(self) -> None:
+        self.working_directory = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.mkdir('data')
+
+        # Enough seasons missing from the id mappings that some of them are only matched by title
+        self.library = standins.SyntheticLibrary(80, unmapped = 0.3)
+        self.library.write_mapping_files('data')
+        for filename in ['tvdbid_to_anidbid.xml', 'anime-offline-database.json']:
+            with open(f'data/{filename}.meta.json', 'w') as f:
+                json.dump({'checked_at': time.time()}, f)
+
+        self.server = standins.start_plex_standin(self.library)
+        self.plex_connection = PlexConnection(standins.url(self.server), 'token')
+        self.mapping = Mapping()
+        for season in self.plex_connection.scan_libraries(['Anime'], 'bulk', full = True):
+            self.mapping.get_anilist_id(season.tvdb_id, season.title, season.season_number, season.year,
+                                        season.episodes)
+
+        unwatched = [(show, season) for show, season in self.library.iter_seasons()
+                     if season.anilist_id is not None and season.watched < season.episodes - 2]
+        self.id_mapped = [season for _, season in unwatched if season.in_scudlee]
+        self.title_matched = [(show, season) for show, season in unwatched if not season.in_scudlee]
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    @staticmethod
+    def list_entry(progress: int, status: str, episodes: int) -> dict:
+        return {'progress': progress, 'status': status, 'media': {'episodes': episodes}}
+
+    def test_seasons_behind_anilist_are_marked_watched(self) -> None:
+        partial, completed = self.id_mapped[:2]
+        user_list = {partial.anilist_id  : self.list_entry(partial.watched + 2, 'CURRENT', partial.episodes),
+                     completed.anilist_id: self.list_entry(0, 'COMPLETED', completed.episodes)}
+        expected = {partial.anilist_id: partial.watched + 2, completed.anilist_id: completed.episodes}
+
+        changes = plan_reverse_sync(self.plex_connection.scan_cache, user_list, self.mapping)
+        self.assertEqual({x.anilist_id: x.progress for x in changes}, expected)
+
+        apply_reverse_sync(self.plex_connection, changes, Metrics())
+        self.assertEqual({partial.anilist_id: partial.watched, completed.anilist_id: completed.watched}, expected)
+
+    def test_seasons_up_to_date_are_skipped(self) -> None:
+        season = self.id_mapped[0]
+        user_list = {season.anilist_id: self.list_entry(season.watched, 'CURRENT', season.episodes)}
+        self.assertEqual(plan_reverse_sync(self.plex_connection.scan_cache, user_list, self.mapping), [])
+
+    def test_title_matches_are_only_synced_when_requested(self) -> None:
+        self.assertTrue(self.title_matched, "The library should have seasons only matched by title")
+        show, season = self.title_matched[0]
+        self.assertEqual(self.mapping.get_mapping_source(show.tvdb_id, str(season.index)), 'title')
+        user_list = {season.anilist_id: self.list_entry(season.episodes, 'COMPLETED', season.episodes)}
+
+        self.assertEqual(plan_reverse_sync(self.plex_connection.scan_cache, user_list, self.mapping), [])
+
+        changes = plan_reverse_sync(self.plex_connection.scan_cache, user_list, self.mapping, title_matches = True)
+        self.assertEqual([(x.anilist_id, x.progress) for x in changes], [(season.anilist_id, season.episodes)])
+        apply_reverse_sync(self.plex_connection, changes, Metrics())
+        self.assertEqual(season.watched, season.episodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+
+import utils
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    """ Tests reading arrays from json files in chunks, which must give the same result whatever the chunk size. """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, 'data.json')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def assert_parses(self, data: dict, key: str = 'data') -> None:
+        """ Checks the array under the key is read correctly with every chunk size up to past the size of the file. """
+        with open(self.filepath, 'w', encoding = 'utf-8') as f:
+            json.dump(data, f)
+        for chunk_size in range(1, os.path.getsize(self.filepath) + 2):
+            with self.subTest(chunk_size = chunk_size):
+                self.assertEqual(list(utils.iter_json_array(self.filepath, key, chunk_size)), data[key])
+
+    def test_floats_split_across_chunks(self) -> None:
+        self.assert_parses({'data': [1.5]})
+        self.assert_parses({'data': [100000.0, -2.5e-3, 12]})
+
+    def test_skipped_key_with_float(self) -> None:
+        self.assert_parses({'skipped': 1.25e10, 'other': {'nested': [0.5, 'text']}, 'data': [1, 2]})
+
+    def test_mixed_values(self) -> None:
+        self.assert_parses({'data': [True, False, None, 'a, b]', {'sources': ['https://anidb.net/anime/1']}, [3.0]]})
+
+    def test_empty_array(self) -> None:
+        self.assert_parses({'data': []})
+
+    def test_missing_key(self) -> None:
+        with open(self.filepath, 'w', encoding = 'utf-8') as f:
+            json.dump({'other': [1.5]}, f)
+        self.assertEqual(list(utils.iter_json_array(self.filepath, 'data', 2)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
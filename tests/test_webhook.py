@@ -0,0 +1,70 @@
+import json
+import queue
+import unittest
+
+import requests
+
+import webhook
+
+EPISODE_PAYLOAD = {
+    'event'   : 'media.scrobble',
+    'Account' : {'title': 'alice'},
+    'Metadata': {'librarySectionTitle': 'Anime', 'type': 'episode', 'title': 'Episode 3',
+                 'grandparentRatingKey': 100, 'parentIndex': 2}
+}
+
+
+class WebhookListenerTest(unittest.TestCase):
+    """ Tests receiving Plex webhooks over http and the seasons they sync. """
+
+    def setUp(self) -> None:
+        self.synced = queue.Queue()
+        self.listener = webhook.WebhookListener(0, ['Anime'], lambda seasons, user: self.synced.put((seasons, user)),
+                                                delay = 0.2, host = '127.0.0.1')
+        self.listener.start()
+        self.url = f'http://127.0.0.1:{self.listener.port}/'
+
+    def tearDown(self) -> None:
+        self.listener.stop()
+
+    def test_multipart_payload(self) -> None:
+        # Plex sends the payload as a form field along with a thumbnail of the item
+        r = requests.post(self.url, files = {'payload': (None, json.dumps(EPISODE_PAYLOAD)),
+                                             'thumb'  : ('thumb.jpg', b'\xff\xd8\xff', 'image/jpeg')})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.synced.get(timeout = 5), ({'100': {'2'}}, 'alice'))
+
+    def test_json_payload(self) -> None:
+        r = requests.post(self.url, json = EPISODE_PAYLOAD)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.synced.get(timeout = 5), ({'100': {'2'}}, 'alice'))
+
+    def test_events_are_synced_together(self) -> None:
+        season = {**EPISODE_PAYLOAD, 'Metadata': {'librarySectionTitle': 'Anime', 'type': 'season',
+                                                  'parentRatingKey': 100, 'index': 1}}
+        requests.post(self.url, json = EPISODE_PAYLOAD)
+        requests.post(self.url, json = season)
+        self.assertEqual(self.synced.get(timeout = 5), ({'100': {'1', '2'}}, 'alice'))
+
+    def test_bad_json_is_rejected(self) -> None:
+        r = requests.post(self.url, data = b'{"event": ', headers = {'Content-Type': 'application/json'})
+        self.assertEqual(r.status_code, 400)
+        r = requests.post(self.url, files = {'payload': (None, '{"event": ')})
+        self.assertEqual(r.status_code, 400)
+
+    def test_request_without_payload_is_rejected(self) -> None:
+        r = requests.post(self.url, data = b'payload', headers = {'Content-Type': 'text/plain'})
+        self.assertEqual(r.status_code, 400)
+        r = requests.post(self.url, files = {'thumb': ('thumb.jpg', b'\xff\xd8\xff', 'image/jpeg')})
+        self.assertEqual(r.status_code, 400)
+
+    def test_other_events_are_ignored(self) -> None:
+        other_library = {**EPISODE_PAYLOAD, 'Metadata': {**EPISODE_PAYLOAD['Metadata'], 'librarySectionTitle': 'TV'}}
+        self.assertEqual(requests.post(self.url, json = other_library).status_code, 200)
+        self.assertEqual(requests.post(self.url, json = {**EPISODE_PAYLOAD, 'event': 'media.play'}).status_code, 200)
+        with self.assertRaises(queue.Empty):
+            self.synced.get(timeout = 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
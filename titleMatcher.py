@@ -0,0 +1,147 @@
+import logging
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import coloredlogs
+
+from mappingIndex import MappingIndex, title_trigrams
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+ROMAN_NUMERALS = {'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6, 'vii': 7, 'viii': 8, 'ix': 9, 'x': 10}
+SEASON_PATTERNS = [re.compile(r'\s*\bseason (\d+)\b'),
+                   re.compile(r'\s*\b(\d+)(?:st|nd|rd|th)? season\b'),
+                   re.compile(r'\s+(\d{1,2})$'),
+                   re.compile(r'\s+(' + '|'.join(ROMAN_NUMERALS) + r')$')]
+
+
+def normalise_title(title: str) -> str:
+    """ Normalises a title so that differences in case, accents and punctuation don't affect matching.
+
+    :param title: The title to normalise.
+    :return: The normalised title.
+    """
+    title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', title).split())
+
+
+def split_season(title: str) -> Tuple[str, int]:
+    """ Splits the season marker, such as 'season 2', '2nd season' or 'ii', off the end of a normalised title.
+
+    :param title: The normalised title.
+    :return: The title without the season marker and the season number, 1 if the title has no marker.
+    """
+    for pattern in SEASON_PATTERNS:
+        if (match := pattern.search(title)) is not None:
+            season = match.group(1)
+            base = (title[:match.start()] + title[match.end():]).strip()
+            if base:
+                return base, ROMAN_NUMERALS.get(season) or int(season)
+    return title, 1
+
+
+@dataclass
+class TitleMatcher:
+    """ Finds the Anilist id of a season from the title of its show when there is no id mapping for it. Candidates are
+    found using the trigram index of the anime offline database titles and synonyms in the mapping index, then scored
+    by how similar their titles are with the season, year and episode count used to pick between close matches.
+
+    mapping_index: The mapping index holding the titles.
+    threshold: The lowest score accepted as a match.
+    margin: How far the best match has to be ahead of the best match for a different show.
+    search_limit: The number of titles read from the index to find candidates. The rarest trigrams of the title are
+                  used until the limit is reached, always including the rarest one.
+    max_candidates: The number of candidates sharing the most trigrams with the title that are scored.
+    """
+    mapping_index: MappingIndex
+    threshold: float = 0.8
+    margin: float = 0.05
+    search_limit: int = 2000
+    max_candidates: int = 20
+
+    def match(self, title: str, season: str, year: Optional[int] = None,
+              episodes: Optional[int] = None) -> Optional[str]:
+        """ Finds the Anilist id that best matches a season of a show.
+
+        :param title: The title of the show.
+        :param season: The season number.
+        :param year: The year the show started, if known.
+        :param episodes: The number of episodes in the season, if known.
+        :return: The Anilist id of the best match or None if no title matched closely enough.
+        """
+        query = normalise_title(title)
+        if not query or not season.isdigit():
+            return None
+
+        # A title similar enough to be accepted shares most of its trigrams so it is found from the rarest few
+        query_trigrams = title_trigrams(query)
+        counts = self.mapping_index.get_title_trigram_counts(query_trigrams)
+        candidates = Counter()
+        searched = 0
+        for trigram in sorted(counts, key = counts.get):
+            if searched and searched + counts[trigram] > self.search_limit:
+                break
+            candidates.update(self.mapping_index.get_title_ids(trigram))
+            searched += counts[trigram]
+        if not candidates:
+            return None
+
+        # Titles that match exactly are always scored as they can be crowded out of the candidates by longer titles
+        scores = {}
+        rows = self.mapping_index.get_titles(x for x, _ in candidates.most_common(self.max_candidates))
+        rows += self.mapping_index.get_titles_by_title(query)
+        for anilist_id, candidate, candidate_season, candidate_episodes, candidate_year in rows:
+            score = self.score(query_trigrams, int(season), year, episodes, candidate, candidate_season,
+                               candidate_episodes, candidate_year)
+            scores[anilist_id] = max(score, scores.get(anilist_id, 0.0))
+
+        ranked = sorted(scores.items(), key = lambda x: x[1], reverse = True) + [(None, 0.0)]
+        (best, best_score), (_, second_score) = ranked[:2]
+        if best_score < self.threshold or best_score - second_score < self.margin:
+            return None
+
+        logger.info(f"Matched {title} Season {season} to Anilist id {best} by title with a score of {best_score:.2f}")
+        return best
+
+    @staticmethod
+    def score(query_trigrams: set, season: int, year: Optional[int], episodes: Optional[int], candidate: str,
+              candidate_season: int, candidate_episodes: Optional[int], candidate_year: Optional[int]) -> float:
+        """ Scores how well a candidate title matches a season of a show.
+
+        :param query_trigrams: The trigrams of the normalised title of the show.
+        :param season: The season number.
+        :param year: The year the show started, if known.
+        :param episodes: The number of episodes in the season, if known.
+        :param candidate: The normalised title of the candidate without its season marker.
+        :param candidate_season: The season in the title of the candidate.
+        :param candidate_episodes: The number of episodes of the candidate, if known.
+        :param candidate_year: The year the candidate started, if known.
+        :return: The score of the candidate, higher is better.
+        """
+        candidate_trigrams = title_trigrams(candidate)
+        score = 2 * len(query_trigrams & candidate_trigrams) / (len(query_trigrams) + len(candidate_trigrams))
+
+        if candidate_season != season:
+            score -= 0.5
+
+        if episodes and candidate_episodes:
+            # Plex can be missing episodes but shouldn't have more than the season has
+            if episodes == candidate_episodes:
+                score += 0.05
+            elif episodes > candidate_episodes:
+                score -= 0.15
+            else:
+                score -= 0.05
+
+        if year and candidate_year:
+            # Later seasons air after the show started so only the first season should share its year
+            if season == 1 and abs(candidate_year - year) <= 1:
+                score += 0.05
+            elif season == 1 or candidate_year < year:
+                score -= 0.1
+
+        return score
@@ -1,6 +1,7 @@
 import json
 import os
-from typing import Union
+import threading
+from typing import Any, Iterator, Union
 
 
 def load_json(filepath: str) -> Union[dict, list]:
@@ -17,11 +18,146 @@ def load_json(filepath: str) -> Union[dict, list]:
 
 
 def save_json(data: Union[list, dict], filepath: str) -> None:
-    """ Save a dictionary of list in a json file format.
+    """ Save a dictionary of list in a json file format. The data is written to a temporary file first and then
+    renamed over the target so the file is never left partially written.
 
     :param data: The data to be saved.
     :param filepath: The filepath to save the data.
     :return: None
     """
-    with open(filepath, 'w', encoding = 'utf-8') as f:
-        json.dump(data, f)
+    # Encoding to a string first uses the C encoder, json.dump encodes in pure python to stream to the file
+    with open(f'{filepath}.tmp', 'w', encoding = 'utf-8') as f:
+        f.write(json.dumps(data))
+    os.replace(f'{filepath}.tmp', filepath)
+
+
+class JsonStore:
+    """ Holds the contents of a json file in memory and writes changes back to the file in the background of a run.
+    Changes are only written once flush is called or after a number of changes have built up, instead of rewriting the
+    whole file for every change.
+
+    Modifications to the data should be made while holding the lock and followed by a call to mark_changed.
+    """
+
+    def __init__(self, filepath: str, flush_every: int = 100) -> None:
+        """ Loads the json file into memory.
+
+        :param filepath: The file path of the json file.
+        :param flush_every: The number of changes to build up before writing them to the file, 0 to only write them
+                            when flush is called.
+        :return: None
+        """
+        self.filepath = filepath
+        self.flush_every = flush_every
+        self.data = load_json(filepath)
+        self.changes = 0
+        self.lock = threading.RLock()
+
+    def mark_changed(self) -> None:
+        """ Records that the data has been changed, writing the changes if enough have built up.
+
+        :return: None
+        """
+        with self.lock:
+            self.changes += 1
+            if self.flush_every and self.changes >= self.flush_every:
+                self.flush()
+
+    def replace(self, data: Union[list, dict]) -> None:
+        """ Replaces all of the data and writes it to the file straight away.
+
+        :param data: The new data.
+        :return: None
+        """
+        with self.lock:
+            self.data = data
+            self.changes += 1
+            self.flush()
+
+    def flush(self) -> None:
+        """ Writes the data to the file if there are any changes that haven't been written yet.
+
+        :return: None
+        """
+        with self.lock:
+            if self.changes:
+                save_json(self.data, self.filepath)
+                self.changes = 0
+
+
+def iter_json_array(filepath: str, key: str, chunk_size: int = 65_536) -> Iterator[Any]:
+    """ Incrementally reads the items of an array stored under a top level key of a json object without loading the
+    whole file into memory. Only the item currently being decoded and a small read buffer are held at a time.
+
+    :param filepath: The file path of the json file to read.
+    :param key: The top level key that holds the array.
+    :param chunk_size: The number of characters to read from the file at a time.
+    :return: The items of the array in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, 'r', encoding = 'utf-8') as f:
+        buffer = ''
+        position = 0
+        eof = False
+
+        def fill() -> None:
+            """ Drops the consumed part of the buffer and reads the next chunk from the file. """
+            nonlocal buffer, position, eof
+            chunk = f.read(chunk_size)
+            eof = chunk == ''
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        def next_token() -> str:
+            """ Skips whitespace and returns the next character without consuming it. """
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if eof:
+                    raise ValueError(f"Unexpected end of json file {filepath}")
+                fill()
+
+        def decode_value() -> Any:
+            """ Decodes the next complete json value, reading more of the file until it has been fully buffered. """
+            nonlocal position
+            next_token()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # A number cut short by the end of a chunk still decodes, such as 1. decoding as 1, so a value is
+                    # only complete once it is followed by a delimiter or the file has ended
+                    if eof or (end < len(buffer) and (buffer[end] in ',:]}' or buffer[end].isspace())):
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(character: str) -> None:
+            """ Consumes the next character, checking that it is the expected one. """
+            nonlocal position
+            if next_token() != character:
+                raise ValueError(f"Expected '{character}' at {position} in json file {filepath}")
+            position += 1
+
+        fill()
+        expect('{')
+        while next_token() != '}':
+            current_key = decode_value()
+            expect(':')
+            if current_key != key:
+                decode_value()
+            else:
+                expect('[')
+                while next_token() != ']':
+                    yield decode_value()
+                    if next_token() == ',':
+                        expect(',')
+                return
+
+            if next_token() == ',':
+                expect(',')
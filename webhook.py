@@ -0,0 +1,185 @@
+import json
+import logging
+import queue
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set
+
+import coloredlogs
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level = 'DEBUG', fmt = '%(asctime)s [%(name)s] %(message)s', logger = logger)
+
+# The Plex events sent when an item is marked as watched
+WATCH_EVENTS = ['media.scrobble']
+
+
+def parse_payload(content_type: str, body: bytes) -> Optional[dict]:
+    """ Extracts the json payload from a Plex webhook request. Plex sends the payload as a multipart form field, a json
+    body is also accepted to make posting recorded payloads easy.
+
+    :param content_type: The Content-Type header of the request.
+    :param body: The body of the request.
+    :return: The payload or None if the request didn't contain one.
+    """
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+
+    if not content_type.startswith('multipart/form-data'):
+        return None
+
+    message = BytesParser(policy = HTTP).parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+    for part in message.iter_parts():
+        if part.get_param('name', header = 'content-disposition') == 'payload':
+            return json.loads(part.get_payload(decode = True))
+    return None
+
+
+def get_affected_season(payload: dict, libraries: List[str]) -> Optional[tuple]:
+    """ Works out which season of which show a webhook is about.
+
+    :param payload: The payload of the webhook.
+    :param libraries: The names of the libraries being synced.
+    :return: The Plex user that watched the season, the rating key of the show and the season number, None for every
+             season, or None if the event can't change the watch state of a synced season.
+    """
+    metadata = payload.get('Metadata') or {}
+    if payload.get('event') not in WATCH_EVENTS or metadata.get('librarySectionTitle') not in libraries:
+        return None
+
+    user = (payload.get('Account') or {}).get('title')
+    if metadata.get('type') == 'episode':
+        return user, str(metadata.get('grandparentRatingKey')), str(metadata.get('parentIndex'))
+    if metadata.get('type') == 'season':
+        return user, str(metadata.get('parentRatingKey')), str(metadata.get('index'))
+    if metadata.get('type') == 'show':
+        return user, str(metadata.get('ratingKey')), None
+    return None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """ Accepts webhooks from Plex and queues the seasons they affect on the listener. """
+
+    def log_message(self, format: str, *args) -> None:
+        """ Send request logs to the debug log instead of stderr. """
+        logger.debug(format % args)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            payload = parse_payload(self.headers.get('Content-Type') or '', body)
+        except ValueError:
+            payload = None
+
+        if payload is None:
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        self.server.listener.handle(payload)
+        self.send_response(200)
+        self.end_headers()
+
+
+class WebhookListener:
+    """ Listens for Plex webhooks on a local http endpoint and syncs the seasons they affect shortly afterwards. Events
+    that arrive close together, such as when several episodes are marked as watched, are synced together in one batch.
+    """
+
+    def __init__(self, port: int, libraries: List[str],
+                 sync: Callable[[Dict[str, Optional[Set[str]]], Optional[str]], object], delay: float = 10,
+                 host: str = '0.0.0.0') -> None:
+        """ Prepares the listener.
+
+        :param port: The port to listen on, 0 for any free port.
+        :param libraries: The names of the libraries being synced. Events from other libraries are ignored.
+        :param sync: The function that syncs the affected seasons, given the seasons to sync keyed by the rating key
+                     of their show and the Plex user that watched them. A value of None means every season of the
+                     show.
+        :param delay: The number of seconds to wait for more events before syncing.
+        :param host: The address to listen on.
+        :return: None
+        """
+        self.libraries = libraries
+        self.sync = sync
+        self.delay = delay
+        self.events = queue.Queue()
+        self.server = ThreadingHTTPServer((host, port), WebhookHandler)
+        self.server.daemon_threads = True
+        self.server.listener = self
+
+    @property
+    def port(self) -> int:
+        """ The port the listener is listening on. """
+        return self.server.server_address[1]
+
+    def start(self) -> None:
+        """ Starts listening for webhooks and syncing the affected seasons on background threads.
+
+        :return: None
+        """
+        logger.info(f"Listening for Plex webhooks on port {self.port}")
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        threading.Thread(target = self.run, daemon = True).start()
+
+    def stop(self) -> None:
+        """ Stops listening for webhooks.
+
+        :return: None
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, payload: dict) -> None:
+        """ Queues the season affected by a webhook to be synced.
+
+        :param payload: The payload of the webhook.
+        :return: None
+        """
+        if (affected := get_affected_season(payload, self.libraries)) is not None:
+            logger.debug(f"Received {payload.get('event')} for {(payload.get('Metadata') or {}).get('title')}")
+            self.events.put(affected)
+
+    def run(self) -> None:
+        """ Syncs the queued seasons in batches until the program ends.
+
+        :return: None
+        """
+        while True:
+            user_seasons = {}
+            self.add_event(user_seasons, self.events.get())
+
+            # Keep collecting events until none have arrived for the delay
+            deadline = time.monotonic() + self.delay
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    self.add_event(user_seasons, self.events.get(timeout = remaining))
+                    deadline = time.monotonic() + self.delay
+                except queue.Empty:
+                    break
+
+            for user, show_seasons in user_seasons.items():
+                try:
+                    self.sync(show_seasons, user)
+                except Exception as e:
+                    # The daily sync will pick up anything missed here
+                    logger.error(f"An error occurred syncing from a webhook: {e}")
+
+    @staticmethod
+    def add_event(user_seasons: Dict[Optional[str], Dict[str, Optional[Set[str]]]], event: tuple) -> None:
+        """ Adds an affected season to a batch of seasons to sync.
+
+        :param user_seasons: The seasons to sync keyed by the Plex user that watched them and the rating key of their
+                             show.
+        :param event: The Plex user, the rating key of the show and the affected season, None for every season.
+        :return: None
+        """
+        user, show, season = event
+        show_seasons = user_seasons.setdefault(user, {})
+        if season is None or (show in show_seasons and show_seasons[show] is None):
+            show_seasons[show] = None
+        else:
+            show_seasons.setdefault(show, set()).add(season)